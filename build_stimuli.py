@@ -1,24 +1,35 @@
+import io
 import numpy as np
 import os
-from scipy.io import wavfile
 from tqdm import tqdm
 
 from src import macro
 from src.analysis import single_cycles
+from src.archive import ArchiveWriter
 from src.defaults import SAMPLE_RATE, SYN_PATH
 from src.util import midi_to_hz, safe_mkdir
+from src.wav_writer import WavWriter
 
 
 # Helper.
-def quick_write(_file_path, _filename, _data):
-    """Write file as 16bit mono PCM."""
+def quick_write(_subject, _block, _condition, _repeat, _data):
+    """Store stimulus as 16bit mono PCM, as a WAV file or in the archive."""
 
-    write_path = os.path.join(_file_path, _filename)
+    # Descriptors of the same stimulus, from the generator's own state.
+    descriptors = None
+    if save_descriptors:
+        descriptors = macro.generator.pop_descriptors()
 
-    amplitude = np.iinfo(np.int16).max
-    _data *= amplitude
+    if output_format == 'archive':
+        archive.add(_subject, _block, _condition, _repeat, _data, descriptors)
+        return
 
-    wavfile.write(write_path, SAMPLE_RATE, _data.astype(np.int16))
+    # Queued, and written in the background.
+    write_path = os.path.join(
+        SYN_PATH,
+        f"subject_{_subject}/block_{_block}/{_condition}_{_repeat}.wav",
+    )
+    writer.submit(write_path, _data, extras=descriptors)
 
 
 # Experiment parameters.
@@ -29,6 +40,35 @@ repeats_per_block = 4
 # Use this to start counting from a subject number greater than 0.
 starting_subject = 200
 
+# Save per-frame harmonic descriptors next to each WAV (`*_descriptors.npz`),
+# or with each stimulus in the archive.
+save_descriptors = True
+macro.generator.emit_descriptors = save_descriptors
+
+# 'wav': one WAV per stimulus in `subject_<s>/block_<b>/` directories.
+# 'archive': a single packed file for the whole build (see `src/archive.py`);
+# `archive.export_wavs` writes the WAV tree from it when needed.
+output_format = 'wav'
+archive_path = os.path.join(
+    SYN_PATH,
+    f"stimuli_{starting_subject}-{starting_subject + num_subjects - 1}.pack",
+)
+
+# Background WAV writing: I/O threads, queue depth (stimuli), TPDF dither.
+write_threads = 2
+write_queue_depth = 16
+dither = False
+
+if output_format == 'archive':
+    archive = ArchiveWriter(archive_path, SAMPLE_RATE, dither=dither)
+else:
+    writer = WavWriter(
+        SAMPLE_RATE,
+        num_threads=write_threads,
+        max_queue=write_queue_depth,
+        dither=dither,
+    )
+
 # Load env as linear amplitude. (CheapTrick calculates the power spectrum.)
 env = single_cycles[0]['env']
 env = np.sqrt(env)
@@ -50,21 +90,22 @@ for s in range(num_subjects):
     s += starting_subject
     print(f"\nGenerating stimuli for subject {s}...")
 
-    # Make subject directory.
+    # Make subject directory and open log (kept in memory for the archive).
     subject_path = os.path.join(SYN_PATH, f"subject_{s}/")
-    safe_mkdir(subject_path)
-
-    # Open log.
-    log_path = os.path.join(subject_path, f"stimlog_subject_{s}.txt")
-    log = open(log_path, "w")
+    if output_format == 'archive':
+        log = io.StringIO()
+    else:
+        safe_mkdir(subject_path)
+        log_path = os.path.join(subject_path, f"stimlog_subject_{s}.txt")
+        log = open(log_path, "w")
 
     log.write(f"Subject: {s}\n" + "-" * 10 + "\n")
 
     for b in tqdm(range(num_blocks)):
 
         # Make block directory.
-        block_path = os.path.join(subject_path, f"block_{b}/")
-        safe_mkdir(block_path)
+        if output_format != 'archive':
+            safe_mkdir(os.path.join(subject_path, f"block_{b}/"))
 
         log.write("\n" + "="*7 + f"\nBlock {b}\n" + "="*7 + "\n")
 
@@ -73,37 +114,52 @@ for s in range(num_subjects):
 
             # BASIC.
             tmp_x = macro.make_basic(synthesis_params)
-            quick_write(block_path, f"BASIC_{r}.wav", tmp_x)
+            quick_write(s, b, "BASIC", r, tmp_x)
 
             # FROZEN.
             tmp_x = macro.make_frozen(synthesis_params)
-            quick_write(block_path, f"FROZEN_{r}.wav", tmp_x)
+            quick_write(s, b, "FROZEN", r, tmp_x)
 
             # FM-ONLY.
             tmp_x = macro.make_fm_only(synthesis_params)
-            quick_write(block_path, f"FM_ONLY_{r}.wav", tmp_x)
+            quick_write(s, b, "FM_ONLY", r, tmp_x)
 
             # SHUFFLE and SHUFFLE RAF.
             tmp_x, tmp_x_raf = macro.make_shuffle(synthesis_params, log)
-            quick_write(block_path, f"SHUFFLE_{r}.wav", tmp_x)
-            quick_write(block_path, f"SHUFFLE_RAF_{r}.wav", tmp_x_raf)
+            quick_write(s, b, "SHUFFLE", r, tmp_x)
+            quick_write(s, b, "SHUFFLE_RAF", r, tmp_x_raf)
 
             # SIMPLE and SIMPLE RAF.
             tmp_x, tmp_x_raf = macro.make_simple(synthesis_params, log)
-            quick_write(block_path, f"SIMPLE_{r}.wav", tmp_x)
-            quick_write(block_path, f"SIMPLE_RAF_{r}.wav", tmp_x_raf)
+            quick_write(s, b, "SIMPLE", r, tmp_x)
+            quick_write(s, b, "SIMPLE_RAF", r, tmp_x_raf)
 
             # RAG and RAG RAF.
             tmp_x, tmp_x_raf = macro.make_rag(synthesis_params, log)
-            quick_write(block_path, f"RAG_{r}.wav", tmp_x)
-            quick_write(block_path, f"RAG_RAF_{r}.wav", tmp_x_raf)
+            quick_write(s, b, "RAG", r, tmp_x)
+            quick_write(s, b, "RAG_RAF", r, tmp_x_raf)
 
             # PAM.
             tmp_x = macro.make_pam(synthesis_params)
-            quick_write(block_path, f"PAM_{r}.wav", tmp_x)
+            quick_write(s, b, "PAM", r, tmp_x)
 
             # Control.
             tmp_x = macro.make_control(synthesis_params)
-            quick_write(block_path, f"CONTROL_{r}.wav", tmp_x)
+            quick_write(s, b, "CONTROL", r, tmp_x)
 
+    if output_format == 'archive':
+        archive.add_log(s, log.getvalue())
     log.close()
+
+if output_format == 'archive':
+    archive.close()
+    print(f"\nWrote {archive_path}.")
+else:
+    writer.close()
+
+    # If `submit` was often blocked, the disk is the bottleneck: deepen the
+    # queue or add write threads.
+    stats = writer.stats()
+    print(f"\nWrote {stats['written']} files; synthesis waited "
+          f"{stats['blocked_seconds']:.1f} s on a full write queue "
+          f"(max depth {stats['max_queue_depth']}/{write_queue_depth}).")
@@ -5,6 +5,7 @@ All rights reserved
 '''
 import numpy as np
 import math
+from functools import lru_cache
 from scipy import signal
 from ext import utils
 from ext import features  #import spectrum2scaletime, scaletime2scalerate, scalerate2cortical, waveform2auditoryspectrogram
@@ -22,19 +23,74 @@ def load_static_params():
     ]
     strf_params['sr_time'] = 250
     return strf_params
+
+
+@lru_cache(maxsize=16)
+def get_resampling_filter(up, down):
+    '''
+    Anti-aliasing FIR for polyphase resampling by `up` / `down`.
+
+    Same design as the `signal.resample_poly` default, computed once per
+    ratio instead of on every call.
+    '''
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return signal.firwin(2 * half_len + 1, 1. / max_rate,
+                         window=('kaiser', 5.0))
+
+
+def resample(wavtemp, audio_fs, resampling_fs, resampler='polyphase'):
+    '''
+    Resample to `resampling_fs`, keeping the historical output length.
+
+    'polyphase' filters at the exact rational ratio (441/160 for 44.1 kHz
+    to 16 kHz), so cost is linear in the signal length. 'fft' is the
+    original `signal.resample`, whose cost depends on the length's factors.
+
+    The two are not interchangeable: the auditory spectrogram differs by
+    about 1% of its peak on a pure tone, but by up to ~14% on broadband
+    input (~11% in the STRF mean). Features from one must not be mixed with
+    features from the other.
+    '''
+    num_samples = int(wavtemp.shape[0] / audio_fs * resampling_fs)
+
+    if resampler == 'fft':
+        return signal.resample(wavtemp, num_samples)
+    elif resampler != 'polyphase':
+        raise ValueError('Unknown resampler: {}.'.format(resampler))
+
+    divisor = math.gcd(int(audio_fs), int(resampling_fs))
+    up = int(resampling_fs) // divisor
+    down = int(audio_fs) // divisor
+
+    out_ = signal.resample_poly(wavtemp, up, down,
+                                window=get_resampling_filter(up, down))
+    return out_[:num_samples]
+
+
 def spectrogram(wavtemp,
                 audio_fs=44100,
                 duration=0.25,
                 duration_cut_decay=0.05,
                 resampling_fs=16000,
                 sr_time=250,
-                offset=0.0):
+                offset=0.0,
+                padding=None,
+                resampler='polyphase'):
+    '''
+    Auditory spectrogram (time x 128 channels).
+
+    `padding` is the number of zeros appended before processing (defaults
+    to `resampling_fs`, as originally); `resampler` is passed to `resample`.
+    '''
     auditory_params = load_static_params()
     # resampling_fs = auditory_params['newFs']
     # duration = auditory_params['duration']
     # duration_cut_decay = auditory_params['duration_cut_decay']
     sr_time = auditory_params['sr_time']
-    wavtemp = np.r_[wavtemp, np.zeros(resampling_fs)]
+    if padding is None:
+        padding = resampling_fs
+    wavtemp = np.r_[wavtemp, np.zeros(padding)]
     # print(duration)
     if duration==-1: 
         print('no duration cut')
@@ -57,8 +113,7 @@ def spectrogram(wavtemp,
     
     wavtemp = (wavtemp / 1.01) / (np.max(wavtemp) + np.finfo(float).eps)
 
-    wavtemp = signal.resample(wavtemp,
-                              int(wavtemp.shape[0] / audio_fs * resampling_fs))
+    wavtemp = resample(wavtemp, audio_fs, resampling_fs, resampler)
 
     waveform2auditoryspectrogram_args = {
         'frame_length':
@@ -127,7 +182,9 @@ def spectrum(wavtemp,
              duration_cut_decay=0.05,
              resampling_fs=16000,
              sr_time=250,
-             offset=0):
+             offset=0,
+             padding=None,
+             resampler='polyphase'):
     # auditory_params = load_static_params()
     # resampling_fs = auditory_params['newFs']
     # duration = auditory_params['duration']
@@ -158,7 +215,7 @@ def spectrum(wavtemp,
     #     wavtemp, **waveform2auditoryspectrogram_args)
     auditory_spectrogram_ = spectrogram(wavtemp, audio_fs, duration,
                                         duration_cut_decay, resampling_fs,
-                                        sr_time, offset)
+                                        sr_time, offset, padding, resampler)
     auditory_spectrum_ = np.mean(auditory_spectrogram_, axis=0)
     return auditory_spectrum_
 
@@ -169,7 +226,9 @@ def mps(wavtemp,
         duration_cut_decay=0.05,
         resampling_fs=16000,
         sr_time=250,
-        offset=0):
+        offset=0,
+        padding=None,
+        resampler='polyphase'):
     # auditory_params = load_static_params()
     # resampling_fs = auditory_params['newFs']
     # duration = auditory_params['duration']
@@ -203,7 +262,7 @@ def mps(wavtemp,
     #     wavtemp, **waveform2auditoryspectrogram_args)
     auditory_spectrogram_ = spectrogram(wavtemp, audio_fs, duration,
                                         duration_cut_decay, resampling_fs,
-                                        sr_time, offset)
+                                        sr_time, offset, padding, resampler)
     strf_args = {
         'num_channels': 128,
         'num_ch_oct': 24,
@@ -230,7 +289,9 @@ def strf(wavtemp,
          duration_cut_decay=0.05,
          resampling_fs=16000,
          sr_time=250,
-         offset=0):
+         offset=0,
+         padding=None,
+         resampler='polyphase'):
     auditory_params = load_static_params()
     scales = auditory_params['scales']
     rates = auditory_params['rates']
@@ -284,7 +345,7 @@ def strf(wavtemp,
     #     wavtemp, **waveform2auditoryspectrogram_args)
     auditory_spectrogram_ = spectrogram(wavtemp, audio_fs, duration,
                                         duration_cut_decay, resampling_fs,
-                                        sr_time, offset)
+                                        sr_time, offset, padding, resampler)
     strf_args = {
         'num_channels': 128,
         'num_ch_oct': 24,
@@ -315,6 +376,71 @@ def strf(wavtemp,
     return strf_
 
 
+def strf_summary(wavtemp,
+                 audio_fs=44100,
+                 duration=0.25,
+                 duration_cut_decay=0.05,
+                 resampling_fs=16000,
+                 sr_time=250,
+                 offset=0,
+                 stats=('mean', ),
+                 percentiles=(),
+                 padding=None,
+                 resampler='polyphase'):
+    '''
+    Time statistics of |STRF|, without building the 4-D cortical tensor.
+
+    Each (scale, rate) slice is reduced over time as soon as it is produced,
+    so peak memory is one (time x freq) slice. Returns a dict with any of
+    'mean' and 'var' (freq x scale x rate) as requested in `stats`, and
+    'percentiles' (len(percentiles) x freq x scale x rate) if given.
+    'mean' equals np.mean(np.abs(strf(...)), axis=0). `padding` and
+    `resampler` are passed to `spectrogram`.
+    '''
+    for stat in stats:
+        if stat not in ['mean', 'var']:
+            raise ValueError('Unknown statistic: {}.'.format(stat))
+
+    auditory_params = load_static_params()
+    scales = auditory_params['scales']
+    rates = auditory_params['rates']
+
+    auditory_spectrogram_ = spectrogram(wavtemp, audio_fs, duration,
+                                        duration_cut_decay, resampling_fs,
+                                        sr_time, offset, padding, resampler)
+    strf_args = {
+        'num_channels': 128,
+        'num_ch_oct': 24,
+        'sr_time': sr_time,
+        'nfft_rate': 2 * 2**utils.nextpow2(auditory_spectrogram_.shape[0]),
+        'nfft_scale': 2 * 2**utils.nextpow2(auditory_spectrogram_.shape[1]),
+        'KIND': 2
+    }
+    mod_scale, phase_scale, _, _ = features.spectrum2scaletime(
+        auditory_spectrogram_, **strf_args)
+
+    scale_rate, phase_scale_rate, _, _ = features.scaletime2scalerate(
+        mod_scale * np.exp(1j * phase_scale), **strf_args)
+
+    shape = (auditory_spectrogram_.shape[1], len(scales), len(rates))
+    summary = {stat: np.zeros(shape) for stat in stats}
+    if len(percentiles):
+        summary['percentiles'] = np.zeros((len(percentiles), ) + shape)
+
+    for i, j, z in features.scalerate2cortical_slices(
+            auditory_spectrogram_, scale_rate, phase_scale_rate, scales,
+            rates, **strf_args):
+        magnitude = np.abs(z)
+        if 'mean' in summary:
+            summary['mean'][:, i, j] = np.mean(magnitude, axis=0)
+        if 'var' in summary:
+            summary['var'][:, i, j] = np.var(magnitude, axis=0)
+        if 'percentiles' in summary:
+            summary['percentiles'][:, :, i, j] = np.percentile(
+                magnitude, percentiles, axis=0)
+    return summary
+
+
 if __name__ == "__main__":
     audio, fs = utils.audio_data(
         '/Users/baptistecaramiaux/Work/Projects/TimbreProject_Thoret/Code\ and\ data/timbreStudies/ext/sounds/Iverson1993Whole/01.W.Violin.aiff'
@@ -0,0 +1,68 @@
+'''
+Held-out evaluation of the Gaussian-kernel metric learnt in `training.py`.
+
+A test stimulus is scored by correlating its kernel distances to every
+training stimulus with its target (dis)similarities to them. Any number of
+test stimuli are scored at once from a weighted Gram product.
+'''
+import numpy as np
+
+EPS = np.finfo(float).eps
+
+
+def weighted_distances(test_input, train_input, sigmas):
+    '''
+    Negative sigma-weighted squared distances (test x train) between the
+    columns of `test_input` (features x M) and `train_input` (features x N).
+
+    |t - x|^2_w = |t|^2_w + |x|^2_w - 2 <t, x>_w, so this is one matrix
+    product plus broadcasting, with no (features x M x N) temporary.
+    '''
+    test_input = np.reshape(test_input, (len(train_input), -1))
+    weights = 1. / np.square(np.ravel(sigmas) + EPS)
+
+    weighted_test = test_input * weights[:, None]
+    test_norms = np.einsum('ij,ij->j', weighted_test, test_input)
+    train_norms = weights @ np.square(train_input)
+
+    distances = (test_norms[:, None] + train_norms[None, :]
+                 - 2 * weighted_test.T @ train_input)
+    return -np.maximum(distances, 0.)
+
+
+def held_out_correlations(test_input, test_target, train_input, sigmas,
+                          ddof=1):
+    '''
+    Correlation, per test stimulus, between its distances to the training
+    stimuli and `test_target` (M x N, or N for one stimulus).
+
+    Normalized by (N - ddof) times the population standard deviations. The
+    default ddof=1 is the testing correlation `training.py` has always
+    logged (N / (N - 1) times Pearson's r); ddof=0 gives Pearson's r.
+    '''
+    distances = weighted_distances(test_input, train_input, sigmas)
+    test_target = np.reshape(test_target, distances.shape)
+
+    distances = distances - distances.mean(axis=1, keepdims=True)
+    test_target = test_target - test_target.mean(axis=1, keepdims=True)
+
+    Jn = np.sum(distances * test_target, axis=1)
+    Jd = ((distances.shape[1] - ddof) * distances.std(axis=1)
+          * test_target.std(axis=1))
+    return Jn / (Jd + EPS)
+
+
+def kfold_indices(num_stimuli, num_folds, seed=None):
+    '''
+    Shuffled split of stimulus indices into `num_folds` (test) folds.
+    '''
+    rng = np.random.RandomState(seed)
+    return np.array_split(rng.permutation(num_stimuli), num_folds)
+
+
+def symmetric_targets(target_data):
+    '''
+    Full symmetric target matrix from its upper triangle.
+    '''
+    upper = np.triu(target_data, k=1)
+    return upper + upper.T
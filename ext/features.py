@@ -8,6 +8,8 @@ Implementation using a light implementation of the Matlab NLS toolbox by TODO
 '''
 import numpy as np
 import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from scipy import signal
 from ext import utils
 
@@ -18,12 +20,9 @@ def spectrum2scaletime(stft, num_channels, num_ch_oct, sr_time, nfft_rate,
     spectrum2scaletime
     '''
     lgt_time = stft.shape[0]
-    mod_scale = np.zeros((lgt_time, nfft_scale), dtype=complex)
-    phase_scale = np.zeros((lgt_time, nfft_scale))
-    # perform a FFT for each time slice
-    for i in range(lgt_time):
-        mod_scale[i, :] = np.fft.fft(stft[i, :], nfft_scale)
-        phase_scale[i, :] = utils.angle(mod_scale[i, :])
+    # perform a FFT for each time slice (all at once, along frequency)
+    mod_scale = np.fft.fft(stft, nfft_scale, axis=1)
+    phase_scale = np.angle(mod_scale)
     mod_scale = np.abs(mod_scale)  # modulus of the fft
     scales = np.linspace(0, nfft_scale + 1, num_ch_oct)
 
@@ -36,12 +35,9 @@ def scaletime2scalerate(mod_scale, num_channels, num_ch_oct, sr_time,
     '''
     scaletime2scalerate
     '''
-    lgt_scale = mod_scale.shape[1]
-    scale_rate = np.zeros((nfft_rate, lgt_scale), dtype=complex)
-    phase_scale_rate = np.zeros((nfft_rate, lgt_scale))
-    for i in range(lgt_scale):
-        scale_rate[:, i] = np.fft.fft(mod_scale[:, i], nfft_rate)
-        phase_scale_rate[:, i] = utils.angle(scale_rate[:, i])
+    # perform a FFT for each scale column (all at once, along time)
+    scale_rate = np.fft.fft(mod_scale, nfft_rate, axis=0)
+    phase_scale_rate = np.angle(scale_rate)
     scale_rate = np.abs(scale_rate)
     rates = np.linspace(0, nfft_rate + 1, sr_time)
     scales = np.linspace(0, nfft_scale + 1, num_ch_oct)
@@ -51,86 +47,224 @@ def scaletime2scalerate(mod_scale, num_channels, num_ch_oct, sr_time,
 def scalerate2cortical(stft, scaleRate, phase_scale_rate, scales, rates,
                        num_channels, num_ch_oct, sr_time, nfft_rate,
                        nfft_scale, KIND):
-    LgtRateVector = len(rates)
-    LgtScaleVector = len(scales)  # length scale vector
+    bank = get_strf_filter_bank(tuple(scales), tuple(rates), num_ch_oct,
+                                sr_time, nfft_rate, nfft_scale, KIND)
+    return bank.cortical(scaleRate, phase_scale_rate, stft.shape[0],
+                         stft.shape[1])
+
+
+def scalerate2cortical_slices(stft, scaleRate, phase_scale_rate, scales,
+                              rates, num_channels, num_ch_oct, sr_time,
+                              nfft_rate, nfft_scale, KIND):
+    '''
+    Yield (scale index, rate index, time x freq slice) of the cortical
+    representation one at a time, so callers that reduce over time never
+    hold the full 4-D tensor.
+    '''
+    bank = get_strf_filter_bank(tuple(scales), tuple(rates), num_ch_oct,
+                                sr_time, nfft_rate, nfft_scale, KIND)
     LgtFreq = stft.shape[1]
     LgtTime = stft.shape[0]
-    cortical_rep = np.zeros(
-        (LgtTime, LgtFreq, LgtScaleVector, LgtRateVector), dtype=complex)
-    for j in range(LgtRateVector):
-        fc_rate = rates[j]
-        t = np.arange(nfft_rate / 2) / sr_time * abs(fc_rate)
-        h = np.sin(2 * math.pi * t) * np.power(t, 2) * np.exp(
-            -3.5 * t) * abs(fc_rate)
-        h = h - np.mean(h)
-        STRF_rate0 = np.fft.fft(h, nfft_rate)
-        A = utils.angle(STRF_rate0[:nfft_rate // 2])
-        A[0] = 0.0  # instead of pi
-        STRF_rate = np.absolute(STRF_rate0[:nfft_rate // 2])
-        STRF_rate = STRF_rate / np.max(STRF_rate)
-        STRF_rate = STRF_rate * np.exp(1j * A)
-        # rate filtering modification
-        # STRF_rate                = [STRF_rate(1:nfft_rate/2); zeros(1,nfft_rate/2)']
-        STRF_rate.resize((nfft_rate, ))
-        STRF_rate[nfft_rate // 2] = np.absolute(STRF_rate[nfft_rate // 2 + 1])
-
-        if (fc_rate < 0):
-            STRF_rate[1:nfft_rate] = np.matrix.conjugate(
-                np.flipud(STRF_rate[1:nfft_rate]))
-
-        z1 = np.zeros((nfft_rate, nfft_scale // 2), dtype=complex)
-        for m in range(nfft_scale // 2):
-            z1[:, m] = STRF_rate * scaleRate[:, m] * np.exp(
-                1j * phase_scale_rate[:, m])
-
-        # z1.resize((nfft_rate,nfft_rate))
-        for i in range(nfft_scale // 2):
-            z1[:, i] = np.fft.ifft(z1[:, i])
-        # print(z1[10,:])
-
-        for i in range(LgtScaleVector):
-            fc_scale = scales[i]
-            R1 = np.arange(nfft_scale / 2) / (
-                nfft_scale / 2) * num_ch_oct / 2 / abs(fc_scale)
-            if KIND == 1:
-                C1 = 1 / 2 / .3 / .3
-                STRF_scale = np.exp(-C1 * np.power(R1 - 1, 2)) + np.exp(
-                    -C1 * np.power(R1 + 1, 2))
-            elif KIND == 2:
-                R1 = np.power(R1, 2)
-                STRF_scale = R1 * np.exp(1 - R1)
-            z = np.zeros((LgtTime, nfft_scale // 2), dtype=complex)
-            for n in range(LgtTime):
-                temp = np.fft.ifft(STRF_scale * z1[n, :], nfft_scale)
-                z[n, :] = temp[:nfft_scale // 2]
-            cortical_rep[:, :, i, j] = z[:LgtTime, :LgtFreq]
-    return cortical_rep
+    for j in range(len(rates)):
+        z1 = bank.filter_rates(scaleRate, phase_scale_rate, LgtTime, j)
+        for i in range(len(scales)):
+            yield i, j, bank.filter_scales(z1, LgtFreq, i)
 
 
-#### NLS lite
+def rate_filter(fc_rate, sr_time, nfft_rate):
+    '''
+    Frequency response of the temporal-modulation (rate) filter.
+    '''
+    t = np.arange(nfft_rate / 2) / sr_time * abs(fc_rate)
+    h = np.sin(2 * math.pi * t) * np.power(t, 2) * np.exp(
+        -3.5 * t) * abs(fc_rate)
+    h = h - np.mean(h)
+    STRF_rate0 = np.fft.fft(h, nfft_rate)
+    A = np.angle(STRF_rate0[:nfft_rate // 2])
+    A[0] = 0.0  # instead of pi
+    STRF_rate = np.absolute(STRF_rate0[:nfft_rate // 2])
+    STRF_rate = STRF_rate / np.max(STRF_rate)
+    STRF_rate = STRF_rate * np.exp(1j * A)
+    # rate filtering modification
+    # STRF_rate                = [STRF_rate(1:nfft_rate/2); zeros(1,nfft_rate/2)']
+    STRF_rate.resize((nfft_rate, ))
+    STRF_rate[nfft_rate // 2] = np.absolute(STRF_rate[nfft_rate // 2 + 1])
+
+    if (fc_rate < 0):
+        STRF_rate[1:nfft_rate] = np.matrix.conjugate(
+            np.flipud(STRF_rate[1:nfft_rate]))
+    return STRF_rate
+
+
+def scale_filter(fc_scale, num_ch_oct, nfft_scale, KIND):
+    '''
+    Frequency response of the spectral-modulation (scale) filter.
+    '''
+    R1 = np.arange(nfft_scale / 2) / (
+        nfft_scale / 2) * num_ch_oct / 2 / abs(fc_scale)
+    if KIND == 1:
+        C1 = 1 / 2 / .3 / .3
+        STRF_scale = np.exp(-C1 * np.power(R1 - 1, 2)) + np.exp(
+            -C1 * np.power(R1 + 1, 2))
+    elif KIND == 2:
+        R1 = np.power(R1, 2)
+        STRF_scale = R1 * np.exp(1 - R1)
+    else:
+        raise ValueError('Unknown scale filter kind: {}.'.format(KIND))
+    return STRF_scale
+
+
+class STRFFilterBank:
+    '''
+    All rate and scale filters of the cortical stage for one shape signature.
 
+    The filters only depend on the constructor arguments, so one bank is
+    shared by every stimulus of the same length (see `get_strf_filter_bank`).
+    '''
 
-def waveform2auditoryspectrogram(x_, frame_length, time_constant,
-                                 compression_factor, octave_shift, filt, VERB):
+    def __init__(self, scales, rates, num_ch_oct, sr_time, nfft_rate,
+                 nfft_scale, KIND):
+        self.nfft_rate = nfft_rate
+        self.nfft_scale = nfft_scale
+
+        # (rates x nfft_rate) and (scales x nfft_scale / 2)
+        self.rate_filters = np.array(
+            [rate_filter(fc_rate, sr_time, nfft_rate) for fc_rate in rates])
+        self.scale_filters = np.array([
+            scale_filter(fc_scale, num_ch_oct, nfft_scale, KIND)
+            for fc_scale in scales
+        ])
+
+    def filter_rates(self, scaleRate, phase_scale_rate, LgtTime,
+                     rate_index=slice(None)):
+        '''
+        Rate-filter every scale column and inverse FFT along time.
+
+        Returns (time x nfft_scale / 2), with a leading rate axis unless
+        `rate_index` is an integer.
+        '''
+        half = self.nfft_scale // 2
+        z1 = self.rate_filters[rate_index, ..., None] * scaleRate[:, :half] * \
+            np.exp(1j * phase_scale_rate[:, :half])
+        return np.fft.ifft(z1, axis=-2)[..., :LgtTime, :]
+
+    def filter_scales(self, z1, LgtFreq, scale_index=slice(None)):
+        '''
+        Scale-filter every time slice of `z1` and inverse FFT along scale.
+
+        Returns (... x time x freq), with a scale axis inserted before time
+        unless `scale_index` is an integer.
+        '''
+        STRF_scale = self.scale_filters[scale_index]
+        if STRF_scale.ndim == 2:
+            STRF_scale = STRF_scale[:, None, :]
+            z1 = z1[..., None, :, :]
+        z = np.fft.ifft(STRF_scale * z1, self.nfft_scale, axis=-1)
+        return z[..., :LgtFreq]
+
+    def cortical(self, scaleRate, phase_scale_rate, LgtTime, LgtFreq):
+        '''
+        Full cortical representation (time x freq x scale x rate).
+
+        All rates are filtered in one product; all scales of a rate are then
+        filtered in one product, one rate at a time to bound the temporary.
+        '''
+        z1 = self.filter_rates(scaleRate, phase_scale_rate, LgtTime)
+
+        # Filled rate-major, returned as a (time x freq x scale x rate) view.
+        cortical_rep = np.zeros((len(self.rate_filters),
+                                 len(self.scale_filters), LgtTime, LgtFreq),
+                                dtype=complex)
+        for j in range(len(self.rate_filters)):
+            cortical_rep[j] = self.filter_scales(z1[j], LgtFreq)
+        return cortical_rep.transpose(2, 3, 1, 0)
+
+
+@lru_cache(maxsize=8)
+def get_strf_filter_bank(scales, rates, num_ch_oct, sr_time, nfft_rate,
+                         nfft_scale, KIND):
     '''
-    Wav2Aud form NSL toolbox
-    @url http://www.isr.umd.edu/Labs/NSL/Software.htm
+    Cached `STRFFilterBank`; `scales` and `rates` must be tuples.
     '''
+    return STRFFilterBank(scales, rates, num_ch_oct, sr_time, nfft_rate,
+                          nfft_scale, KIND)
+
 
-    # if (filt == 'k'):
-    #     raise ValueError('Please use wav2aud_fir function for FIR filtering!')
+#### NLS lite
+
+
+@lru_cache(maxsize=None)
+def cochlear_sos():
+    '''
+    Second-order sections for every COCHBA channel (lowest to highest).
 
-    # if (filt == 'p_o'):
-    #     COCHBA = np.genfromtxt('COCHBA_aud24_old.txt', dtype=str)
-    # else:
-    #     COCHBA = np.genfromtxt('COCHBA_aud24.txt', dtype=str)
-    # # convert str to complex (may be a better way...)
-    # COCHBA = np.asarray(
-    #     [[complex(i.replace('i', 'j')) for i in COCHBA[row, :]]
-    #      for row in range(len(COCHBA))])
+    COCHBA holds the filter order in its first row and B + 1j * A below it;
+    converting once to SOS keeps the high-order (up to 24) filters stable.
+    '''
     COCHBA = utils.COCHBA
+    sos_bank = []
+    for ch in range(COCHBA.shape[1]):
+        p = int(COCHBA[0, ch].real)
+        B = COCHBA[np.arange(p + 1) + 1, ch].real
+        A = COCHBA[np.arange(p + 1) + 1, ch].imag
+        sos_bank.append(signal.tf2sos(B, A))
+    return tuple(sos_bank)
+
+
+def cochlear_filterbank(x, num_workers=1):
+    '''
+    Filter `x` through all cochlear channels. Returns (channels x samples).
+
+    Channels are independent, so with `num_workers` > 1 they are split across
+    a thread pool (SciPy releases the GIL while filtering).
+    '''
+    sos_bank = cochlear_sos()
+    num_channels = len(sos_bank)
+    out_ = np.empty((num_channels, len(x)))
+
+    def filter_channels(channels):
+        for ch in channels:
+            out_[ch] = signal.sosfilt(sos_bank[ch], x)
+
+    if num_workers > 1:
+        groups = np.array_split(np.arange(num_channels), num_workers)
+        with ThreadPoolExecutor(num_workers) as pool:
+            list(pool.map(filter_channels, groups))
+    else:
+        filter_channels(range(num_channels))
+
+    return out_
+
+
+def leaky_integrate_frames(y, alph, L_frm):
+    '''
+    Leaky integration of `y` (channels x samples), read at each frame end.
+
+    Equivalent to filtering with 1 / (1 - alph z^-1) and keeping every
+    `L_frm`-th sample, but only the frame ends are computed: each frame is
+    reduced with a decaying FIR (one matrix product for all channels) and
+    the recursion then runs at the frame rate.
+    '''
+    num_channels, num_samples = y.shape
+    N = num_samples // L_frm
+
+    weights = alph ** np.arange(L_frm - 1, -1, -1)
+    frames = y.reshape(num_channels, N, L_frm) @ weights
 
-    L, M = COCHBA.shape[0], COCHBA.shape[1]  # p_max = L - 2;
+    return signal.lfilter([1.0], [1.0, -alph**L_frm], frames, axis=-1)
+
+
+def waveform2auditoryspectrogram(x_, frame_length, time_constant,
+                                 compression_factor, octave_shift, filt, VERB,
+                                 num_workers=1):
+    '''
+    Wav2Aud form NSL toolbox
+    @url http://www.isr.umd.edu/Labs/NSL/Software.htm
+
+    All channels are processed together as one (channels x samples) array;
+    the hair cell, lateral inhibition and integration stages each run once
+    over the whole bank instead of once per channel.
+    '''
     L_x = len(x_)  # length of input
 
     # octave shift, nonlinear factor, frame length, leaky integration
@@ -148,84 +282,84 @@ def waveform2auditoryspectrogram(x_, frame_length, time_constant,
     # get data, allocate memory for ouput
     N = math.ceil(L_x / L_frm)
     x = x_.copy()
-    x.resize((N * L_frm, 1))  # zero-padding
-    v5 = np.zeros((N, M - 1))
-
-    #% last channel (highest frequency)
-    p = COCHBA[0, M - 1].real
-    B = COCHBA[np.arange(int(p) + 1) + 1, M - 1].real
-    A = COCHBA[np.arange(int(p) + 1) + 1, M - 1].imag
-    y1 = signal.lfilter(B, A, x, axis=0)
-    y2 = utils.sigmoid(y1, fac)
+    x.resize((N * L_frm, ))  # zero-padding
+
+    # ANALYSIS: cochlear filterbank
+    y = cochlear_filterbank(x, num_workers)
+    y = utils.sigmoid(y, fac)
+
+    # hair cell membrane (low-pass <= 4 kHz) ---> (ignored for linear)
     if (fac != -2):
-        y2 = signal.lfilter([1.0], [1.0, -beta], y2, axis=0)
-    y2_h = y2
-    # % All other channels
-    for ch in range((M - 2), -1, -1):
-        # ANALYSIS: cochlear filterbank
-        p = COCHBA[0, ch].real
-        B = COCHBA[np.arange(int(p) + 1) + 1, ch].real
-        A = COCHBA[np.arange(int(p) + 1) + 1, ch].imag
-        y1 = signal.lfilter(B, A, x, axis=0)
-        y2 = utils.sigmoid(y1, fac)
-        # hair cell membrane (low-pass <= 4 kHz) ---> y2 (ignored for linear)
-        if (fac != -2): y2 = signal.lfilter([1.0], [1.0, -beta], y2, axis=0)
-
-        y3 = y2 - y2_h
-        y2_h = y2
-        # half-wave rectifier ---> y4
-        y4 = np.maximum(y3, 0)
-
-        # temporal integration window ---> y5
-        if alph:  # leaky integration
-            y5 = signal.lfilter([1.0], [1.0, -alph], y4, axis=0)
-            v5[:, ch] = y5[L_frm * np.arange(1, N + 1) - 1].reshape(
-                -1, )
-        else:  # short-term average
-            if (L_frm == 1):
-                v5[:, ch] = y4
-            else:
-                v5[:, ch] = np.mean(y4.reshape(L_frm, N), axis=0)
-
-    return v5
-
-
-def complexSpectrogram(waveform, windowSize, frameStep):
-    # % Figure out the fftSize (twice the window size because we are doing
-    # % circular convolution).  We'll place the windowed time-domain signal into
-    # % the middle of the buffer (zeros before and after the signal in the array.)
+        y = signal.lfilter([1.0], [1.0, -beta], y, axis=-1)
+
+    # lateral inhibition against the next channel up, half-wave rectified
+    y4 = np.subtract(y[:-1], y[1:], out=y[:-1])
+    np.maximum(y4, 0, out=y4)
+
+    # temporal integration window
+    if alph:  # leaky integration
+        v5 = leaky_integrate_frames(y4, alph, L_frm)
+    else:  # short-term average
+        if (L_frm == 1):
+            v5 = y4
+        else:
+            v5 = np.mean(y4.reshape(-1, L_frm, N), axis=1)
+
+    return v5.T
+
+
+def complexSpectrogram(waveform, windowSize, frameStep, complex_output=False,
+                       chunk_size=None):
+    '''
+    Spectrogram (fftSize x frameCount) of Hamming-windowed frames, with
+    fftSize = 2 * windowSize (circular convolution). As in the Matlab
+    original, each frame sits in the middle of a zero-padded buffer that is
+    fftshift-ed, so the centre of the window defines 0 phase.
+
+    Frames are a zero-copy strided view and all of them (or `chunk_size` at
+    a time, to bound memory on long inputs) go through one batched real FFT.
+    The buffer centring is a circular shift, i.e. a phase ramp, so it only
+    matters (and is only applied) when `complex_output` is True. Otherwise
+    the magnitude is returned, mirrored up to fftSize.
+    '''
+    waveform = np.asarray(waveform)
     fftSize = 2 * windowSize
     fftB = math.floor(windowSize / 2)
-    fftE = fftB + windowSize
-    fftBuffer = np.zeros((fftSize))
 
-    # r, c = waveform.shape[0], waveform.shape[1]
-    r = len(waveform)
-    # if r > c:
-    #     waveform = np.tranpose(waveform)
+    frameCount = math.floor((len(waveform) - windowSize) / frameStep) + 1
 
-    frameCount = math.floor((r - windowSize) / frameStep) + 1
-
-    spectrogram__ = np.zeros((fftSize, frameCount))
     # % h = hamming(windowSize)';
     h = 0.54 - 0.46 * np.cos(2 * math.pi * np.arange(windowSize) /
                              (windowSize - 1))
-    # % h = h * 0 + 1;              % Just for debugging, no window.
-
-    # % Note: This code loads the waveform data (times hamming) into the center
-    # % of the fftSize buffer.  Then uses fftshift to rearrange things so that
-    # % the 0-time is Matlab sample 1.  This means that the center of the window
-    # % defines 0 phase.  After ifft, zero time will be at the same place.
-    for frameNumber in range(frameCount):
-        waveB = frameNumber * frameStep
-        waveE = waveB + windowSize
-        fftBuffer = 0.0 * fftBuffer  # make sure the buffer is empty
-        fftBuffer[fftB:fftE] = waveform[waveB:waveE] * h
-        fftBuffer = np.fft.fftshift(fftBuffer)
-        # % fftBuffer(fftE+1:end) = 0;
-        # % transpose (without the conjugate) into a column vector.
-        # print(np.fft(fftBuffer).shape)
-        spectrogram__[:, frameNumber] = np.transpose(np.abs(np.fft.fft(fftBuffer)))
-    return spectrogram__
-    # end
-    # pass
+
+    frames = np.lib.stride_tricks.sliding_window_view(
+        waveform, windowSize)[:frameCount * frameStep:frameStep]
+
+    if chunk_size is None:
+        chunk_size = frameCount
+
+    num_bins = fftSize // 2 + 1
+    out_ = np.empty((frameCount, num_bins),
+                    dtype=complex if complex_output else float)
+
+    if complex_output:
+        # Frame starts at fftB in the buffer, then fftshift moves it by
+        # -fftSize / 2: a delay of `shift` samples, modulo fftSize.
+        shift = fftB - fftSize // 2
+        ramp = np.exp(-2j * np.pi * np.arange(num_bins) * shift / fftSize)
+
+    for start in range(0, frameCount, chunk_size):
+        stop = min(start + chunk_size, frameCount)
+        spectrum = np.fft.rfft(frames[start:stop] * h, fftSize, axis=1)
+
+        if complex_output:
+            out_[start:stop] = spectrum * ramp
+        else:
+            out_[start:stop] = np.abs(spectrum)
+
+    # Negative frequencies of a real signal: conjugate mirror of the positive.
+    mirror = out_[:, -2:0:-1]
+    if complex_output:
+        mirror = np.conj(mirror)
+
+    return np.concatenate([out_, mirror], axis=1).T
@@ -2,24 +2,52 @@ import numpy as np
 from scipy.optimize import minimize
 
 
+def print_progress(every=25):
+    """
+    Progress hook printing a one-line summary every `every` iterations.
+    """
+    def hook(iteration, sigmas, correlation):
+        if iteration % every:
+            return
+        print(
+            f"  |_ loop={iteration} J={correlation:.6f} "
+            f"sigma min/median/max="
+            f"{np.min(sigmas):.3g}/{np.median(sigmas):.3g}/{np.max(sigmas):.3g}"
+        )
+    return hook
+
+
 def optimize_wrapper(
         inputs,
         targets,
         init_sigma_mean=10.0,
         init_sigma_variance=0.5,
         num_loops=10000,
+        progress=print_progress(),
 ):
+    """
+    Fit per-feature sigmas so that the kernel correlates with `targets`.
+
+    `progress`, if given, is called as progress(iteration, sigmas, corr)
+    after every L-BFGS iteration; it decides itself how often to report
+    (see `print_progress`). Returns the `scipy.optimize.OptimizeResult`.
+    """
     num_features, num_stimuli = inputs.shape
 
     target_mean = np.mean(targets)
     target_std = np.std(targets)
+    centred_targets = targets - target_mean
+
+    # Only sigma changes between evaluations.
+    squared_inputs = np.square(inputs)
 
     # Randomize from a normal distribution about given mean.
     init_sigmas = np.abs(
-        init_sigma_mean + init_sigma_variance * np.random.randn(num_features, 1)
+        init_sigma_mean + init_sigma_variance * np.random.randn(num_features)
     )
 
-    gradients = np.zeros_like(init_sigmas)
+    gradients = np.zeros(num_features)
+    scale = np.zeros(num_features)
 
     optimization_options = {'disp': None,
                             'maxls': 50,
@@ -34,22 +62,19 @@ def optimize_wrapper(
         (1.0 * i, 1e15 * i) for i in np.ones((num_features,))
     ]
 
-    def correlation(sigmas):
-        kernel = np.zeros(num_stimuli)
+    def get_kernel(sigmas):
+        # kernel[i] = -sum_k (inputs[k, i] / sigma_k)^2, for all i at once.
+        weights = 1. / np.square(sigmas + np.finfo(float).eps)
+        return -(weights @ squared_inputs)
 
-        for i in range(num_stimuli):
-            kernel[i] = -np.sum(
-                np.power(
-                    np.divide(inputs[:, i], sigmas + np.finfo(float).eps),
-                    2
-                )
-            )
+    def correlation(sigmas):
+        kernel = get_kernel(sigmas)
 
         kernel_mean = np.mean(kernel)
         kernel_std = np.std(kernel)
 
         a = np.sum(
-            np.multiply(kernel - kernel_mean, targets - target_mean)
+            np.multiply(kernel - kernel_mean, centred_targets)
         )
 
         b = num_stimuli * target_std * kernel_std
@@ -57,55 +82,45 @@ def optimize_wrapper(
         return a / b
 
     def gradient(sigmas):
-        kernel = np.zeros(num_stimuli)
-        d_kernel = np.zeros([num_stimuli, len(inputs)])
-
-        for i in range(num_stimuli):
-            kernel[i] = -np.sum(
-                np.power(
-                    np.divide(inputs[:, i], sigmas + np.finfo(float).eps),
-                    2
-                )
-            )
-            d_kernel[i, :] = 2 * np.divide(
-                np.power(inputs[:, i], 2),
-                (np.power(sigmas, 3) + np.finfo(float).eps)
-            )
+        kernel = get_kernel(sigmas)
 
         kernel_mean = np.mean(kernel)
         kernel_std = np.std(kernel)
 
-        Jn = np.sum(
-            np.multiply(
-                kernel - kernel_mean, targets - target_mean
-            )
-        )
-
+        Jn = np.sum(np.multiply(kernel - kernel_mean, centred_targets))
         Jd = num_stimuli * target_std * kernel_std
 
-        for k in range(num_features):
-            tmp = d_kernel[:, k]
-            dJn = np.sum(tmp * (targets - target_mean))
-            dJd = np.divide(
-                target_std * np.sum(tmp * (kernel - kernel_mean)),
-                kernel_std + np.finfo(float).eps
-            )
-            gradients[k] = np.divide(
-                Jd * dJn - Jn * dJd,
-                np.power(Jd, 2) + np.finfo(float).eps
-            )
+        # d_kernel[i, k] = 2 inputs[k, i]^2 / sigma_k^3, so the sums over
+        # stimuli are products of `squared_inputs` with centred vectors.
+        np.power(sigmas, 3, out=scale)
+        np.add(scale, np.finfo(float).eps, out=scale)
+        np.divide(2., scale, out=scale)
+
+        dJn = scale * (squared_inputs @ centred_targets)
+        dJd = scale * (squared_inputs @ (kernel - kernel_mean))
+        dJd *= target_std / (kernel_std + np.finfo(float).eps)
+
+        np.multiply(Jd, dJn, out=gradients)
+        np.subtract(gradients, Jn * dJd, out=gradients)
+        np.divide(gradients, np.power(Jd, 2) + np.finfo(float).eps,
+                  out=gradients)
         return gradients
 
+    iteration = 0
+
     def call_back(sigmas):
-        # Ideally would save here.
-        print(sigmas)
+        nonlocal iteration
+        iteration += 1
+        if progress is not None:
+            progress(iteration, sigmas, correlation(sigmas))
 
-    _ = minimize(correlation, init_sigmas, args=(), method='L-BFGS-B',
-                 jac=gradient, callback=call_back,
-                 options=optimization_options, bounds=optimization_bounds)
+    return minimize(correlation, init_sigmas, args=(), method='L-BFGS-B',
+                    jac=gradient, callback=call_back,
+                    options=optimization_options, bounds=optimization_bounds)
 
 
 if __name__ == '__main__':
     test_inputs = np.random.rand(10000, 500)
     test_targets = np.random.rand(500)
-    optimize_wrapper(test_inputs, test_targets)
+    res = optimize_wrapper(test_inputs, test_targets)
+    print(res.message, res.fun)
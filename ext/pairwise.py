@@ -0,0 +1,193 @@
+'''
+Pairwise-distance engine for the Gaussian-kernel metric learning in
+`training.py`.
+
+Everything in the kernel-correlation objective except sigma is constant,
+so the squared feature differences of every stimulus pair (upper triangle,
+in `np.triu_indices` order) are computed once, as a (pairs x features)
+matrix. The kernel is then one matrix-vector product with 1 / sigma^2 and
+the analytic gradient one transposed product, with no (N x N x D) tensor.
+'''
+import numpy as np
+
+EPS = np.finfo(float).eps
+
+
+class PairwiseDifferences:
+    '''
+    Squared differences (pairs x features) of the columns of `input_data`
+    (features x stimuli).
+
+    For large problems, store them in float32 and/or in a memory-mapped
+    `.npy` file (`memmap_path`), or fill a preallocated (pairs x features)
+    array `out`, e.g. in shared memory. They are filled, and float32
+    products taken, `chunk_size` pairs at a time (in float64), so neither
+    costs a full-size temporary.
+    '''
+    def __init__(self, input_data, dtype=np.float64, memmap_path=None,
+                 chunk_size=1024, out=None):
+        num_features, num_stimuli = input_data.shape
+        self.idx_triu = np.triu_indices(num_stimuli, k=1)
+        self.num_pairs = len(self.idx_triu[0])
+        self.num_features = num_features
+        self.chunk_size = chunk_size
+
+        shape = (self.num_pairs, num_features)
+        if out is not None:
+            assert out.shape == shape, 'Wrong shape for `out`.'
+            self.squared = out
+        elif memmap_path is None:
+            self.squared = np.empty(shape, dtype=dtype)
+        else:
+            self.squared = np.lib.format.open_memmap(
+                memmap_path, mode='w+', dtype=dtype, shape=shape)
+
+        rows, cols = self.idx_triu
+        for start, stop in self._chunks():
+            diff = (input_data[:, rows[start:stop]]
+                    - input_data[:, cols[start:stop]]).T
+            np.square(diff, out=diff)
+            self.squared[start:stop] = diff
+
+    @classmethod
+    def from_squared(cls, squared, chunk_size=1024):
+        '''
+        Wrap an existing (pairs x features) squared-difference array, e.g.
+        one in shared memory or a sampled mini-batch, without copying it.
+        The pairs need not be a full upper triangle.
+        '''
+        self = cls.__new__(cls)
+        num_pairs, self.num_features = squared.shape
+
+        self.idx_triu = None
+        self.num_pairs = num_pairs
+        self.chunk_size = chunk_size
+        self.squared = squared
+        return self
+
+    def _chunks(self):
+        for start in range(0, self.num_pairs, self.chunk_size):
+            yield start, min(start + self.chunk_size, self.num_pairs)
+
+    def dot(self, weights):
+        '''
+        (pairs,) = squared @ weights, with `weights` of shape (features,).
+        '''
+        if self.squared.dtype == np.float64:
+            return self.squared @ weights
+
+        out_ = np.empty(self.num_pairs)
+        for start, stop in self._chunks():
+            out_[start:stop] = \
+                self.squared[start:stop].astype(np.float64) @ weights
+        return out_
+
+    def tdot(self, vectors):
+        '''
+        squared.T @ vectors, with `vectors` of shape (pairs,) or (pairs, k).
+        '''
+        if self.squared.dtype == np.float64:
+            return self.squared.T @ vectors
+
+        out_ = np.zeros((self.num_features,) + vectors.shape[1:])
+        for start, stop in self._chunks():
+            out_ += self.squared[start:stop].astype(np.float64).T \
+                @ vectors[start:stop]
+        return out_
+
+    def kernel(self, sigmas, mask=None):
+        '''
+        Upper-triangle log-kernel values -sum(((x_i - x_j) / sigma)^2) over
+        the features selected by a 0/1 `mask` (all if None).
+        '''
+        weights = 1. / np.square(np.ravel(sigmas) + EPS)
+        if mask is not None:
+            weights = weights * mask
+        return -self.dot(weights)
+
+    def correlation(self, sigmas, target_values, mask=None):
+        '''
+        Pearson correlation between kernel and target values.
+        '''
+        kernel_v = self.kernel(sigmas, mask)
+        return kernel_correlation(kernel_v, target_values)[0]
+
+    def correlation_and_gradient(self, sigmas, target_values, mask=None):
+        '''
+        Correlation and its analytic gradient w.r.t. sigma (features,).
+
+        Features outside `mask` get a zero gradient.
+        '''
+        sigmas = np.ravel(sigmas)
+        kernel_v = self.kernel(sigmas, mask)
+        corr, Jn, Jd, std_kernel = kernel_correlation(kernel_v, target_values)
+
+        mean_target = np.mean(target_values)
+        std_target = np.std(target_values)
+
+        # d kernel / d sigma_k = 2 (x_ik - x_jk)^2 / sigma_k^3, so the sums
+        # over pairs for dJn and dJd are one transposed product.
+        centred = np.stack([target_values - mean_target,
+                            kernel_v - np.mean(kernel_v)], axis=1)
+        sums = self.tdot(centred)
+        scale = 2. / (np.power(sigmas, 3) + EPS)
+
+        dJn = scale * sums[:, 0]
+        dJd = std_target / (std_kernel + EPS) * scale * sums[:, 1]
+
+        gradients = (Jd * dJn - Jn * dJd) / (np.power(Jd, 2) + EPS)
+        if mask is not None:
+            gradients *= mask
+        return corr, gradients
+
+
+def full_kernel(input_data, sigmas, block_size=256):
+    '''
+    Upper-triangle log-kernel values for all pairs of the columns of
+    `input_data` (features x stimuli), without the (pairs x features) matrix.
+
+    Uses |x_i - x_j|^2_w = |x_i|^2_w + |x_j|^2_w - 2 <x_i, x_j>_w, one
+    (block_size x N) weighted Gram product at a time, so memory stays
+    O(block_size * N) and the work is BLAS matrix products.
+    '''
+    weights = 1. / np.square(np.ravel(sigmas) + EPS)
+    num_stimuli = input_data.shape[1]
+
+    weighted = input_data * weights[:, None]
+    norms = np.einsum('ij,ij->j', weighted, input_data)
+
+    out_ = []
+    for start in range(0, num_stimuli - 1, block_size):
+        stop = min(start + block_size, num_stimuli - 1)
+        gram = weighted[:, start:stop].T @ input_data
+        distances = norms[start:stop, None] + norms[None, :] - 2 * gram
+        for row, i in enumerate(range(start, stop)):
+            out_.append(distances[row, i + 1:])
+
+    return -np.maximum(np.concatenate(out_), 0.)
+
+
+def sample_pairs(rng, num_stimuli, num_pairs):
+    '''
+    `num_pairs` stimulus pairs (rows < cols), uniform over unordered pairs.
+    '''
+    rows = rng.randint(num_stimuli, size=num_pairs)
+    cols = rng.randint(num_stimuli - 1, size=num_pairs)
+    cols += cols >= rows
+    return np.minimum(rows, cols), np.maximum(rows, cols)
+
+
+def kernel_correlation(kernel_v, target_values):
+    '''
+    Pearson correlation of kernel and target values, with its numerator,
+    denominator and the kernel standard deviation (for the gradient).
+    '''
+    no_samples = len(kernel_v)
+    mean_kernel = np.mean(kernel_v)
+    std_kernel = np.std(kernel_v)
+    mean_target = np.mean(target_values)
+    std_target = np.std(target_values)
+
+    Jn = np.sum(np.multiply(kernel_v - mean_kernel, target_values - mean_target))
+    Jd = no_samples * std_target * std_kernel
+    return Jn / Jd, Jn, Jd, std_kernel
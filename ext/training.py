@@ -3,13 +3,112 @@
 
 # Modified by Max Henry, April 5, 2021 for use in his thesis; lord help him.
 
+import copy
 import numpy as np
 import matplotlib.pylab as plt
 import pickle
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from scipy.optimize import minimize, dual_annealing
-import subprocess
-import random
+
+from ext.evaluation import (held_out_correlations, kfold_indices,
+                            symmetric_targets)
+from ext.pairwise import (PairwiseDifferences, full_kernel,
+                          kernel_correlation, sample_pairs)
+
+
+class TrainingState:
+    '''
+    In-memory record of an optimization run, checkpointed in the background.
+
+    Holds the loop count, training/testing correlations and latest sigmas.
+    Every `checkpoint_every` loops a snapshot is pickled by a single worker
+    thread (so writes stay in order) to `checkpoint.pkl` in the log folder,
+    via a temporary file and `os.replace`, so a crash never leaves a torn
+    checkpoint. Snapshots carry the keys `kernel_optim_lbfgs_log` reads from
+    `resume`, and `optimizer_state`, anything else a run needs to resume
+    (e.g. Adam moments in `kernel_optim_stochastic`).
+    '''
+    def __init__(self, log_foldername, init_seed, resume=None,
+                 checkpoint_every=25):
+        self.log_foldername = log_foldername
+        self.checkpoint_every = checkpoint_every
+        self.init_seed = init_seed
+
+        if resume is not None:
+            self.loop = resume['retrieved_loop']
+            self.correlations = list(resume['correlations'])
+            self.testing_correlations = list(
+                resume.get('testing_correlations', []))
+            self.sigmas = resume['sigmas']
+            self.gradients = resume['gradients']
+            self.optimizer_state = resume.get('optimizer_state')
+        else:
+            self.loop = 0
+            self.correlations = []
+            self.testing_correlations = []
+            self.sigmas = init_seed
+            self.gradients = np.zeros_like(init_seed)
+            self.optimizer_state = None
+
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def update(self, sigmas, correlation, testing_correlation=0.0,
+               gradients=None):
+        self.loop += 1
+        self.sigmas = sigmas
+        self.correlations.append(correlation)
+        self.testing_correlations.append(testing_correlation)
+        if gradients is not None:
+            self.gradients = gradients
+
+        if self.loop % self.checkpoint_every == 0:
+            self.checkpoint()
+
+    def snapshot(self):
+        return {
+            'init_seed': self.init_seed,
+            'sigmas': np.copy(self.sigmas),
+            'gradients': np.copy(self.gradients),
+            'correlations': list(self.correlations),
+            'testing_correlations': list(self.testing_correlations),
+            'retrieved_loop': self.loop,
+            'optimizer_state': copy.deepcopy(self.optimizer_state),
+        }
+
+    def checkpoint(self, filename='checkpoint.pkl', data=None):
+        '''
+        Queue an atomic write of `data` (default: a state snapshot).
+        '''
+        if data is None:
+            data = self.snapshot()
+        path = os.path.join(self.log_foldername, filename)
+
+        # Drop finished writes, surfacing any error they raised.
+        for future in [f for f in self._pending if f.done()]:
+            future.result()
+            self._pending.remove(future)
+
+        self._pending.append(self._writer.submit(self._write, path, data))
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(data, handle)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        '''
+        Write a final checkpoint and wait for all writes to finish.
+        '''
+        self.checkpoint()
+        self._writer.shutdown(wait=True)
+        for future in self._pending:
+            future.result()
+        self._pending = []
 
 
 def kernel_optim_lbfgs_log(input_data,
@@ -26,7 +125,28 @@ def kernel_optim_lbfgs_log(input_data,
                            logging=False,
                            verbose=True,
                            allow_resume=True,
-                           test_data=None):
+                           test_data=None,
+                           pairwise_dtype=np.float64,
+                           pairwise_memmap=None,
+                           checkpoint_every=25,
+                           seed=None,
+                           pairwise=None,
+                           return_result=False):
+    '''
+    Fit per-feature Gaussian kernel widths (sigmas) so that the kernel over
+    stimulus pairs correlates with `target_data`.
+
+    `method` is any `scipy.optimize.minimize` method, or 'dual_annealing'
+    (global search within [1, init_sig_mean * 100] per feature, polished by
+    L-BFGS-B). `seed` makes the initial draw reproducible. A prebuilt
+    `PairwiseDifferences` may be passed as `pairwise` (see
+    `kernel_optim_multistart`). Returns the correlations per loop and the
+    final sigmas, plus the optimizer's result (`res.fun` is the minimized
+    objective, `res.x` its sigmas) if `return_result`.
+
+    The logged correlations are those of the exponentiated kernel, for
+    monitoring; the objective minimized is the correlation of the log kernel.
+    '''
 
     if (verbose):
         print(
@@ -39,15 +159,15 @@ def kernel_optim_lbfgs_log(input_data,
         init_seed = resume['init_seed']
         init_sigmas = resume['sigmas']
         gradients = resume['gradients']
-        correlations = resume['correlations']
-        retrieved_loop = resume['retrieved_loop']
     else:
+        rng = np.random if seed is None else np.random.RandomState(seed)
         init_sigmas = np.abs(
-            init_sig_mean + init_sig_var * np.random.randn(num_model_features, 1))
+            init_sig_mean + init_sig_var * rng.randn(num_model_features, 1))
         init_seed = init_sigmas
         gradients = np.zeros((num_model_features, 1))
-        correlations = []  # = np.zeros((num_loops, ))
-        retrieved_loop = 0
+
+    # Correlations, sigmas and checkpoints live here, not in `tmp.pkl`.
+    state = TrainingState(log_foldername, init_seed, resume, checkpoint_every)
 
     num_model_features, num_stimuli = input_data.shape[0], input_data.shape[1]
     no_samples = num_stimuli * (num_stimuli - 1) / 2
@@ -56,7 +176,10 @@ def kernel_optim_lbfgs_log(input_data,
     mean_target = np.mean(target_values)
     std_target = np.std(target_values)
 
-    testing_correlations = []
+    # Squared differences of every stimulus pair; only sigma varies below.
+    if pairwise is None:
+        pairwise = PairwiseDifferences(input_data, dtype=pairwise_dtype,
+                                       memmap_path=pairwise_memmap)
 
     optimization_options = {'disp': None, 'maxls': 50, 'iprint': -1,
                             'gtol': 1e-36, 'eps': 1e-8, 'maxiter': num_loops,
@@ -80,153 +203,403 @@ def kernel_optim_lbfgs_log(input_data,
             'optimization_options': {'options': optimization_options, 'bounds': optimization_bounds}
         }, open(os.path.join(log_foldername, 'optim_config.pkl'), 'wb'))
 
-    def corr(x):
-        kernel = np.zeros((num_stimuli, num_stimuli))
+    def dropout_mask():
+        if dropout == 0.0:
+            return None
+
+        # Randomly keep a (1 - dropout) fraction of the features.
+        idx = np.random.permutation(len(input_data))
+        idx = idx[:int((1.0 - dropout) * len(idx))]
+
+        mask = np.zeros(len(input_data))
+        mask[idx] = 1.0
+        return mask
 
-        # Make an index value for every entry in all the input data (all stims).
-        idx = [i for i in range(len(input_data))]
+    # Last full (no dropout) kernel computed by `corr`, reused for logging.
+    last_kernel = {'x': None, 'kernel_v': None}
 
+    def corr(x):
         # Clip to the within the boundary values.
         x = np.clip(x, a_min=1.0, a_max=1e15)
 
-        # If using dropout, randomly truncate index list.
-        if dropout > 0.0:
-            random.shuffle(idx)
-            idx = idx[:int((1.0 - dropout) * len(idx))]
-
-        for i in range(num_stimuli):
-            for j in range(i + 1, num_stimuli):
-
-                # Calculate the distance value, where x is sigma being trained.
-                kernel[i, j] = -np.sum(
-                    np.power(
-                        np.divide(input_data[idx, i] - input_data[idx, j],
-                                  (x[idx] + np.finfo(float).eps)), 2))
-        kernel_v = kernel[idx_triu]
-        mean_kernel = np.mean(kernel_v)
-        std_kernel = np.std(kernel_v)
-        Jn = np.sum(np.multiply(kernel_v - mean_kernel, target_values - mean_target))
-        Jd = no_samples * std_target * std_kernel
-        return Jn / Jd
+        mask = dropout_mask()
+        kernel_v = pairwise.kernel(x, mask)
+        if mask is None:
+            last_kernel['x'] = x
+            last_kernel['kernel_v'] = kernel_v
+
+        return kernel_correlation(kernel_v, target_values)[0]
 
     def grad_corr(sigmas):
-        idx = [i for i in range(len(input_data))]
-        if dropout > 0.0:
-            random.shuffle(idx)
-            idx = idx[:int((1.0 - dropout) * len(idx))]
-        ndims = len(idx)
-        kernel = np.zeros((num_stimuli, num_stimuli))
-        dkernel = np.zeros((num_stimuli, num_stimuli, ndims))
-        for i in range(num_stimuli):
-            for j in range(i + 1, num_stimuli):
-                kernel[i, j] = -np.sum(
-                    np.power(
-                        np.divide(input_data[idx, i] - input_data[idx, j],
-                                  (sigmas[idx] + np.finfo(float).eps)), 2))
-                dkernel[i, j, :] = 2 * np.power(
-                    (input_data[idx, i] - input_data[idx, j]), 2) / (
-                                           np.power(sigmas[idx], 3) + np.finfo(
-                                           float).eps)
-        kernel_v = kernel[idx_triu]
-        mean_kernel = np.mean(kernel_v)
-        std_kernel = np.std(kernel_v)
-        Jn = np.sum(np.multiply(kernel_v - mean_kernel, target_values - mean_target))
-        Jd = no_samples * std_target * std_kernel
-
-        for k in range(ndims):
-            tmp = dkernel[:, :, k][idx_triu]
-            dJn = np.sum(tmp * (target_values - mean_target))
-            dJd = std_target / (std_kernel + np.finfo(float).eps) * np.sum(
-                tmp * (kernel_v - mean_kernel))
-            gradients[k] = (Jd * dJn - Jn * dJd) / (
-                        np.power(Jd, 2) + np.finfo(float).eps)
+        _, gradients_ = pairwise.correlation_and_gradient(
+            sigmas, target_values, dropout_mask())
+        gradients[:, 0] = gradients_
         return gradients
 
     def print_corr(xk):
-        kernel = np.zeros((num_stimuli, num_stimuli))
-        for i in range(num_stimuli):
-            for j in range(i + 1, num_stimuli):
-                kernel[i, j] = np.exp(-np.sum(
-                    np.power(
-                        np.divide(input_data[:, i] - input_data[:, j],
-                                  (xk + np.finfo(float).eps)), 2)))
-        kernel_v = kernel[idx_triu]
-        mean_kernel = np.mean(kernel_v)
-        std_kernel = np.std(kernel_v)
-        Jn = np.sum(np.multiply(kernel_v - mean_kernel, target_values - mean_target))
-        Jd = no_samples * std_target * std_kernel
-
-        if not os.path.isfile(os.path.join(log_foldername, 'tmp.pkl')):
-            loop_cpt = 1
-            pickle.dump({'loop': loop_cpt, 'correlation': [Jn / Jd]},
-                        open(os.path.join(log_foldername, 'tmp.pkl'), 'wb'))
-            correlations = [Jn / Jd]
-            pickle.dump({
-                'sigmas': xk,
-                'kernel': kernel,
+        if last_kernel['x'] is not None and np.array_equal(last_kernel['x'], xk):
+            kernel_v = np.exp(last_kernel['kernel_v'])
+        else:
+            kernel_v = np.exp(pairwise.kernel(xk))
+        correlation, Jn, Jd, _ = kernel_correlation(kernel_v, target_values)
+
+        if test_data is not None:
+            # Held-out stimuli (features x M) against their targets (M x N).
+            testing_correlation = np.mean(held_out_correlations(
+                test_data[0], test_data[1], input_data, xk))
+        else:
+            testing_correlation = 0.0
+
+        state.update(np.copy(xk), correlation, testing_correlation, gradients)
+
+        monitoring_step = 25
+        if (state.loop % monitoring_step == 0):
+            if verbose:
+                print('  |_ loop={} J={:.6f} {:.6f}'.format(
+                    state.loop, correlation, testing_correlation))
+            process = {
+                'sigmas': np.copy(xk),
                 'Jn': Jn,
                 'Jd': Jd,
-                'correlations': correlations,
-            }, open(os.path.join(log_foldername,
-                                 'optim_process_l={}.pkl'.format(loop_cpt)),
-                    'wb'))
+                'correlations': list(state.correlations),
+            }
+            if logging:
+                # The full N x N kernel, only when asked for.
+                kernel = np.zeros((num_stimuli, num_stimuli))
+                kernel[idx_triu] = kernel_v
+                process['kernel'] = kernel
+            state.checkpoint(
+                'optim_process_l={}.pkl'.format(state.loop), process)
+
+    if method == 'dual_annealing':
+        res = dual_annealing(
+            corr,
+            bounds=[(1.0, 100 * init_sig_mean)] * num_model_features,
+            x0=np.clip(init_sigmas.ravel(), 1.0, 100 * init_sig_mean),
+            maxiter=num_loops,
+            seed=seed,
+            minimizer_kwargs={'method': 'L-BFGS-B', 'jac': grad_corr},
+            callback=lambda x, f, context: print_corr(x),
+        )
+    else:
+        res = minimize(corr, init_sigmas.ravel(), args=(), method=method,
+                       jac=grad_corr, callback=print_corr,
+                       options=optimization_options, bounds=optimization_bounds)
+    state.close()
+    if return_result:
+        return state.correlations, state.sigmas, res
+    return state.correlations, state.sigmas
+
+
+# Arrays shared with multi-start workers, attached by `_attach_shared`.
+_shared = {}
+
+
+def _empty_shared(shape, dtype):
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    array = np.ndarray(shape, dtype, buffer=block.buf)
+    return block, array, (block.name, tuple(shape), dtype.str)
+
+
+def _to_shared(array):
+    block, shared, spec = _empty_shared(array.shape, array.dtype)
+    shared[...] = array
+    return block, spec
+
+
+def _attach_shared(specs):
+    '''
+    Attach to shared-memory blocks, or open `.npy` paths memory-mapped.
+    '''
+    for key, spec in specs.items():
+        if isinstance(spec, str):
+            _shared[key] = np.load(spec, mmap_mode='r')
+            continue
+        name, shape, dtype = spec
+        block = shared_memory.SharedMemory(name=name)
+        _shared[key + '_block'] = block
+        _shared[key] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _run_restart(seed, log_foldername, kwargs):
+    os.makedirs(log_foldername, exist_ok=True)
+    correlations, sigmas, res = kernel_optim_lbfgs_log(
+        _shared['input_data'],
+        _shared['target_data'],
+        log_foldername=log_foldername,
+        seed=seed,
+        pairwise=PairwiseDifferences.from_squared(_shared['squared']),
+        return_result=True,
+        **kwargs)
+    return {
+        'seed': seed,
+        'log_foldername': log_foldername,
+        'objective': float(res.fun),
+        'x': res.x,
+        'correlation': correlations[-1] if correlations else np.nan,
+        'correlations': correlations,
+        'sigmas': sigmas,
+    }
+
+
+def kernel_optim_multistart(input_data,
+                            target_data,
+                            num_restarts=8,
+                            seeds=None,
+                            num_workers=None,
+                            log_foldername='./',
+                            **kwargs):
+    '''
+    Run `kernel_optim_lbfgs_log` from `num_restarts` random initialisations
+    (one per seed) across worker processes.
+
+    The input and target arrays are placed in shared memory once; workers
+    attach to them instead of receiving copies. The pairwise squared
+    differences are built directly in shared memory, with `pairwise_dtype`
+    (or in the `.npy` file `pairwise_memmap`, which workers map read-only),
+    so only one copy ever exists. Each restart logs to
+    `<log_foldername>/restart_<seed>`. Remaining keyword arguments (e.g.
+    method='dual_annealing', num_loops) are passed through.
+
+    Returns one dict per restart: seed, minimized objective (`objective`,
+    the optimizer's `res.fun`) and its sigmas (`x`), and the monitoring
+    correlation trace (`correlations`, `correlation` its last value) with
+    the last logged sigmas. Restarts are sorted by objective, ascending: the
+    first is the best.
+    '''
+    if seeds is None:
+        seeds = list(range(num_restarts))
+    kwargs.setdefault('verbose', False)
+    pairwise_dtype = kwargs.pop('pairwise_dtype', np.float64)
+    pairwise_memmap = kwargs.pop('pairwise_memmap', None)
+
+    blocks, specs = [], {}
+    try:
+        for key, array in [('input_data', np.ascontiguousarray(input_data)),
+                           ('target_data', np.ascontiguousarray(target_data))]:
+            block, specs[key] = _to_shared(array)
+            blocks.append(block)
+
+        num_stimuli = input_data.shape[1]
+        shape = (num_stimuli * (num_stimuli - 1) // 2, input_data.shape[0])
+        if pairwise_memmap is None:
+            block, squared, specs['squared'] = _empty_shared(
+                shape, pairwise_dtype)
+            blocks.append(block)
+            PairwiseDifferences(input_data, out=squared)
+            del squared
         else:
-            last_loop = pickle.load(
-                open(os.path.join(log_foldername, 'tmp.pkl'), 'rb'))
-            loop_cpt = last_loop['loop'] + 1
-            correlations = last_loop['correlation']
-            correlations.append(Jn / Jd)
-
-            if test_data != None:
-                # testing data
-                test_input = test_data[0]
-                test_target = test_data[1]
-                mean_target_test = np.mean(test_target)
-                std_target_test = np.std(test_target)
-                distances = np.zeros((input_data.shape[1], 1))
-                for i in range(len(distances)):
-                    distances[i, 0] = -np.sum(np.power(
-                        np.divide(test_input - input_data[:, i],
-                                  (xk + np.finfo(float).eps)), 2))
-                mean_distances = np.mean(distances)
-                stddev_distances = np.std(distances)
-                Jn_ = np.sum(np.multiply(distances - mean_distances,
-                                         test_target - mean_target_test))
-                Jd_ = std_target_test * stddev_distances * (num_stimuli - 1)
-                testing_correlations.append(Jn_ / Jd_)
-            else:
-                testing_correlations.append(0.0)
-
-            monitoring_step = 25
-            if (loop_cpt % monitoring_step == 0):
-                print('  |_ loop={} J={:.6f} {:.6f}'.format(loop_cpt, Jn / Jd,
-                                                            testing_correlations[
-                                                                -1]))
-                pickle.dump({
-                    'sigmas': xk,
-                    'kernel': kernel,
-                    'Jn': Jn,
-                    'Jd': Jd,
-                    'correlations': correlations
-                }, open(os.path.join(log_foldername,
-                                     'optim_process_l={}.pkl'.format(loop_cpt)),
-                        'wb'))
-                # plt.figure(figsize=(10,10))
-                # plt.subplot(1,2,1)
-                # plt.plot(xk)
-                # plt.subplot(1,2,2)
-                # plt.plot(correlations)
-                # plt.plot(testing_correlations)
-                # plt.savefig('log_sig_corr_lbfgs.pdf')
-            pickle.dump(
-                {'loop': loop_cpt, 'correlation': correlations, 'sigmas': xk},
-                open(os.path.join(log_foldername, 'tmp.pkl'), 'wb'))
-
-    res = minimize(corr, init_sigmas, args=(), method=method, jac=grad_corr,
-                   callback=print_corr, options=optimization_options,
-                   bounds=optimization_bounds)
-    last_loop = pickle.load(open(os.path.join(log_foldername, 'tmp.pkl'), 'rb'))
-    sigmas_ = last_loop['sigmas']
-    correlations = last_loop['correlation']
-    subprocess.run(["rm", os.path.join(log_foldername, 'tmp.pkl')])
-    return correlations, sigmas_
\ No newline at end of file
+            pairwise = PairwiseDifferences(input_data, dtype=pairwise_dtype,
+                                           memmap_path=pairwise_memmap)
+            pairwise.squared.flush()
+            del pairwise
+            specs['squared'] = pairwise_memmap
+
+        with ProcessPoolExecutor(num_workers, initializer=_attach_shared,
+                                 initargs=(specs,)) as pool:
+            futures = [
+                pool.submit(
+                    _run_restart, seed,
+                    os.path.join(log_foldername, 'restart_{}'.format(seed)),
+                    kwargs)
+                for seed in seeds
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return sorted(results, key=lambda result: result['objective'])
+
+
+def _run_fold(fold, test_idx, train_idx, log_foldername, kwargs):
+    input_data = _shared['input_data']
+    targets = _shared['targets']
+
+    os.makedirs(log_foldername, exist_ok=True)
+    correlations, sigmas = kernel_optim_lbfgs_log(
+        input_data[:, train_idx],
+        targets[np.ix_(train_idx, train_idx)],
+        log_foldername=log_foldername,
+        **kwargs)
+
+    test_correlations = held_out_correlations(
+        input_data[:, test_idx], targets[np.ix_(test_idx, train_idx)],
+        input_data[:, train_idx], sigmas)
+
+    return {
+        'fold': fold,
+        'test_idx': test_idx,
+        'correlations': correlations,
+        'sigmas': sigmas,
+        'test_correlations': test_correlations,
+        'test_correlation': np.mean(test_correlations),
+    }
+
+
+def kernel_optim_kfold(input_data,
+                       target_data,
+                       num_folds=5,
+                       num_workers=None,
+                       log_foldername='./',
+                       seed=None,
+                       **kwargs):
+    '''
+    K-fold cross-validation of `kernel_optim_lbfgs_log`, folds in parallel.
+
+    Stimuli are split into `num_folds` shuffled folds; each fold is trained
+    on the remaining stimuli (logging to `<log_foldername>/fold_<k>`) and
+    scored on its held-out stimuli with `evaluation.held_out_correlations`.
+    `seed` sets both the split and each fold's initial sigmas. Inputs and
+    targets are shared with the workers through shared memory.
+
+    Returns one dict per fold (held-out indices, training trace, sigmas,
+    per-stimulus and mean test correlations).
+    '''
+    kwargs.setdefault('verbose', False)
+    kwargs['seed'] = seed
+    folds = kfold_indices(input_data.shape[1], num_folds, seed)
+
+    blocks, specs = [], {}
+    for key, array in [('input_data', np.ascontiguousarray(input_data)),
+                       ('targets', symmetric_targets(target_data))]:
+        block, specs[key] = _to_shared(array)
+        blocks.append(block)
+
+    try:
+        with ProcessPoolExecutor(num_workers, initializer=_attach_shared,
+                                 initargs=(specs,)) as pool:
+            futures = [
+                pool.submit(
+                    _run_fold, k, test_idx,
+                    np.setdiff1d(np.arange(input_data.shape[1]), test_idx),
+                    os.path.join(log_foldername, 'fold_{}'.format(k)),
+                    kwargs)
+                for k, test_idx in enumerate(folds)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return results
+
+
+def kernel_optim_stochastic(input_data,
+                            target_data,
+                            init_sig_mean=10.0,
+                            init_sig_var=0.5,
+                            batch_pairs=4096,
+                            feature_fraction=1.0,
+                            optimizer='adam',
+                            learning_rate=0.01,
+                            num_steps=10000,
+                            eval_every=100,
+                            log_foldername='./',
+                            checkpoint_every=10,
+                            verbose=True,
+                            seed=None,
+                            resume=None):
+    '''
+    Mini-batch version of `kernel_optim_lbfgs_log` for large stimulus sets.
+
+    Each step samples `batch_pairs` stimulus pairs and a `feature_fraction`
+    subset of features (as index arrays), and takes an Adam or SGD step on
+    log(sigma) with the batch correlation gradient. Memory is
+    O(batch_pairs x features) per step. Every `eval_every` steps the
+    correlation of the exponentiated kernel over all pairs (see
+    `pairwise.full_kernel`) is logged, the same quantity
+    `kernel_optim_lbfgs_log` logs, so the two traces are comparable. They
+    are checkpointed like `kernel_optim_lbfgs_log`'s (`checkpoint_every`
+    counts evaluations), together with the step count, Adam moments and
+    random state, so `resume` continues the same run.
+
+    Returns the full-batch correlations and the final sigmas.
+    '''
+    if optimizer not in ['adam', 'sgd']:
+        raise ValueError("Unknown optimizer: {}.".format(optimizer))
+
+    rng = np.random.RandomState(seed)
+    num_model_features, num_stimuli = input_data.shape
+
+    if resume is not None:
+        init_seed = resume['init_seed']
+        sigmas = np.ravel(resume['sigmas'])
+        if resume.get('optimizer_state') is not None:
+            rng.set_state(resume['optimizer_state']['random_state'])
+    else:
+        sigmas = np.abs(init_sig_mean
+                        + init_sig_var * rng.randn(num_model_features))
+        init_seed = sigmas.reshape(-1, 1)
+
+    state = TrainingState(log_foldername, init_seed, resume, checkpoint_every)
+
+    idx_triu = np.triu_indices(num_stimuli, k=1)
+    all_target_values = target_data[idx_triu]
+    num_features = max(1, int(round(feature_fraction * num_model_features)))
+
+    # Optimize log(sigma), kept within the usual [1, 1e15] bounds.
+    log_sigmas = np.log(np.maximum(sigmas, 1.0))
+    first_moment = np.zeros(num_model_features)
+    second_moment = np.zeros(num_model_features)
+    beta1, beta2 = 0.9, 0.999
+    start_step = 0
+
+    if state.optimizer_state is not None:
+        start_step = state.optimizer_state['step']
+        first_moment = state.optimizer_state['first_moment']
+        second_moment = state.optimizer_state['second_moment']
+
+    for step in range(start_step + 1, num_steps + 1):
+        rows, cols = sample_pairs(rng, num_stimuli, batch_pairs)
+        # Gather only the sampled (features x pairs) entries.
+        if num_features < num_model_features:
+            features = rng.permutation(num_model_features)[:num_features]
+            diff = (input_data[np.ix_(features, rows)]
+                    - input_data[np.ix_(features, cols)]).T
+        else:
+            features = slice(None)
+            diff = (input_data[:, rows] - input_data[:, cols]).T
+        batch = PairwiseDifferences.from_squared(np.square(diff, out=diff))
+
+        sigmas = np.exp(log_sigmas)
+        _, batch_gradients = batch.correlation_and_gradient(
+            sigmas[features], target_data[rows, cols])
+
+        # Chain rule: d/d log(sigma) = sigma * d/d sigma.
+        gradients = np.zeros(num_model_features)
+        gradients[features] = batch_gradients * sigmas[features]
+
+        if optimizer == 'adam':
+            first_moment = beta1 * first_moment + (1 - beta1) * gradients
+            second_moment = beta2 * second_moment + (1 - beta2) * gradients ** 2
+            update = (first_moment / (1 - beta1 ** step)) / (
+                np.sqrt(second_moment / (1 - beta2 ** step)) + 1e-8)
+        else:
+            update = gradients
+
+        log_sigmas -= learning_rate * update
+        np.clip(log_sigmas, 0.0, np.log(1e15), out=log_sigmas)
+
+        if step % eval_every == 0 or step == num_steps:
+            sigmas = np.exp(log_sigmas)
+            correlation = kernel_correlation(
+                np.exp(full_kernel(input_data, sigmas)), all_target_values)[0]
+
+            state.optimizer_state = {
+                'step': step,
+                'first_moment': np.copy(first_moment),
+                'second_moment': np.copy(second_moment),
+                'random_state': rng.get_state(),
+            }
+            state.update(sigmas, correlation, gradients=gradients[:, None])
+
+            if verbose:
+                print('  |_ step={} J={:.6f}'.format(step, correlation))
+
+    state.close()
+    return state.correlations, state.sigmas
@@ -17,9 +17,7 @@ def nextpow2(n):
     return counter
 
 def angle(compl_values):
-    real_values = np.array([x.real for x in compl_values])
-    imag_values = np.array([x.imag for x in compl_values])
-    return np.arctan2(imag_values, real_values)
+    return np.angle(compl_values)
 
 
 def sigmoid(x, fac):
@@ -6,13 +6,13 @@ import pyworld as pw
 from glob import glob
 from scipy.signal import find_peaks, decimate
 
+from audio_io import read_wav
 from defaults import ANA_PATH, PITCH_RATE
 from util import (
     force_mono,
     get_amp_envelope,
     low_pass,
     normalize,
-    read_wav,
     trim_to_duration,
     trim_silence
 )
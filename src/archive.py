@@ -0,0 +1,258 @@
+"""
+Single-file packed stimulus archive, an alternative to one WAV per stimulus.
+
+A build is written as one file: 16-bit PCM of every stimulus (and its
+synthesis descriptors, if any) back to back, followed by a JSON index of
+(subject, block, condition, repeat) -> offset/length and the subjects'
+stimulus logs. Readers memory-map the file, so a stimulus is a zero-copy
+view. `export_wavs` materializes the usual directory tree when needed.
+
+    MAGIC | arrays, each 64-byte aligned | JSON index |
+    index offset (<u8) | index length (<u8) | MAGIC
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import numpy as np
+import os
+
+from defaults import SAMPLE_RATE, STIMULUS_PATTERN, SYN_PATH
+from wav_writer import quantize
+
+MAGIC = b'AMPPACK1'
+ALIGNMENT = 64
+FOOTER = np.dtype([('offset', '<u8'), ('length', '<u8')])
+
+
+def export_wavs(archive_path, out_path=SYN_PATH, subjects=None,
+                num_workers=None):
+    """
+    Write the archive's stimuli as `subject_<s>/block_<b>/<CONDITION>_<r>.wav`
+    under `out_path`, with their descriptors and stimulus logs, as a direct
+    WAV build would. Returns the number of stimuli written.
+    """
+    from scipy.io import wavfile
+
+    reader = ArchiveReader(archive_path)
+    keys = [k for k in reader if subjects is None or k[0] in subjects]
+
+    def write(key):
+        path = os.path.join(out_path, stimulus_path(key))
+        wavfile.write(path, reader.sample_rate, np.asarray(reader.pcm(key)))
+
+        descriptors = reader.descriptors(key)
+        if descriptors:
+            np.savez(path.replace('.wav', '_descriptors.npz'), **descriptors)
+
+    for subject, block in sorted({k[:2] for k in keys}):
+        os.makedirs(os.path.join(out_path, f"subject_{subject}",
+                                 f"block_{block}"), exist_ok=True)
+
+    for subject in sorted({k[0] for k in keys}):
+        if subject in reader.logs:
+            log_path = os.path.join(out_path, f"subject_{subject}",
+                                    f"stimlog_subject_{subject}.txt")
+            with open(log_path, 'w') as handle:
+                handle.write(reader.logs[subject])
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        list(pool.map(write, keys))
+
+    return len(keys)
+
+
+def stimulus_key(path: str) -> tuple:
+    """
+    (subject, block, condition, repeat) of an experiment stimulus path,
+    parsed as `data_util.parse_stimulus_paths` does.
+    """
+    match = STIMULUS_PATTERN.match(path)
+    try:
+        return (int(match['subjectNo']), int(match['block']),
+                match['condition'], int(match['repeat']))
+    except (TypeError, ValueError):
+        raise KeyError(f"Not a stimulus path: {path}.") from None
+
+
+def stimulus_path(key: tuple) -> str:
+    """
+    Relative WAV path of a (subject, block, condition, repeat) key.
+    """
+    subject, block, condition, repeat = key
+    return f"subject_{subject}/block_{block}/{condition}_{repeat}.wav"
+
+
+class ArchiveReader:
+    """
+    Memory-mapped, read-only access to an archive written by `ArchiveWriter`.
+
+    Stimuli are addressed by (subject, block, condition, repeat) keys or by
+    stimulus path, and iterate in the order they were written.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+
+        footer_size = FOOTER.itemsize + len(MAGIC)
+        if (bytes(self._data[:len(MAGIC)]) != MAGIC
+                or bytes(self._data[-len(MAGIC):]) != MAGIC):
+            raise ValueError(f"Not a complete stimulus archive: {path}.")
+
+        footer = np.frombuffer(
+            self._data[-footer_size:-len(MAGIC)].tobytes(), dtype=FOOTER)[0]
+        start = int(footer['offset'])
+        index = json.loads(
+            bytes(self._data[start:start + int(footer['length'])]))
+
+        self.sample_rate = index['sample_rate']
+        self.logs = {int(s): text for s, text in index['logs'].items()}
+        self._entries = {
+            (e['subject'], e['block'], e['condition'], e['repeat']): e
+            for e in index['entries']
+        }
+
+    def __contains__(self, key):
+        return self._key(key) in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(key):
+        return stimulus_key(key) if isinstance(key, str) else tuple(key)
+
+    def _view(self, spec):
+        dtype = np.dtype(spec['dtype'])
+        stop = spec['offset'] + dtype.itemsize * int(np.prod(spec['shape']))
+        return self._data[spec['offset']:stop].view(dtype).reshape(
+            spec['shape'])
+
+    def content_hash(self, key) -> str:
+        """
+        SHA-256 of a stimulus' PCM samples (for `FeatureStore` keys).
+        """
+        return hashlib.sha256(self.pcm(key)).hexdigest()
+
+    def descriptors(self, key) -> dict:
+        """
+        Synthesis descriptors stored with a stimulus (views; may be empty).
+        """
+        entry = self._entries[self._key(key)]
+        return {
+            name: self._view(spec)
+            for name, spec in entry.get('descriptors', {}).items()
+        }
+
+    def pcm(self, key) -> np.ndarray:
+        """
+        16-bit samples of a stimulus; a view into the mapped file.
+        """
+        entry = self._entries[self._key(key)]
+        return self._view(
+            {'offset': entry['offset'], 'shape': [entry['length']],
+             'dtype': '<i2'})
+
+    def signal(self, key) -> np.ndarray:
+        """
+        Float samples of a stimulus, scaled as `audio_io.read_wav` would
+        read its exported WAV.
+        """
+        return self.pcm(key) / float(-np.iinfo(np.int16).min)
+
+
+class ArchiveWriter:
+    """
+    Appends stimuli to a new archive at `path`.
+
+    Everything goes to `<path>.tmp`, renamed into place by `close` once the
+    index is written, so an interrupted build leaves no archive that looks
+    complete. Quantization (and optional TPDF dither) is as for `WavWriter`.
+    """
+    def __init__(
+            self,
+            path: str,
+            sample_rate: int = SAMPLE_RATE,
+            dither: bool = False,
+            seed=None,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.dither = dither
+
+        self._rng = np.random.default_rng(seed)
+        self._entries = {}
+        self._logs = {}
+
+        self._file = open(path + '.tmp', 'wb')
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def _put(self, array):
+        """
+        Write `array` at the next aligned offset and return its index spec.
+        """
+        array = np.ascontiguousarray(array)
+        padding = -self._file.tell() % ALIGNMENT
+        self._file.write(b'\0' * padding)
+
+        spec = {'offset': self._file.tell(), 'shape': list(array.shape),
+                'dtype': array.dtype.str}
+        self._file.write(array.tobytes())
+        return spec
+
+    def add(self, subject, block, condition, repeat, data, descriptors=None):
+        """
+        Quantize and append one stimulus, with its synthesis descriptors.
+        """
+        key = (int(subject), int(block), condition, int(repeat))
+        if key in self._entries:
+            raise ValueError(f"Duplicate stimulus: {stimulus_path(key)}.")
+
+        spec = self._put(quantize(data, self.dither, self._rng))
+
+        entry = dict(zip(['subject', 'block', 'condition', 'repeat'], key))
+        entry.update(offset=spec['offset'], length=spec['shape'][0])
+        if descriptors:
+            entry['descriptors'] = {
+                name: self._put(np.asarray(value))
+                for name, value in descriptors.items()
+            }
+        self._entries[key] = entry
+
+    def add_log(self, subject, text: str):
+        self._logs[str(int(subject))] = text
+
+    def close(self):
+        """
+        Write the index and footer, and move the archive into place.
+        """
+        if self._file.closed:
+            return
+
+        index = json.dumps({
+            'version': 1,
+            'sample_rate': self.sample_rate,
+            'entries': list(self._entries.values()),
+            'logs': self._logs,
+        }).encode('utf-8')
+
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(
+            np.array([(offset, len(index))], dtype=FOOTER).tobytes())
+        self._file.write(MAGIC)
+        self._file.close()
+
+        os.replace(self.path + '.tmp', self.path)
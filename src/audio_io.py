@@ -0,0 +1,14 @@
+"""
+Audio file input (librosa-backed).
+"""
+
+import numpy as np
+
+from librosa import load
+
+from defaults import SAMPLE_RATE
+
+
+def read_wav(path: str):
+    x, sample_rate = load(path, sr=SAMPLE_RATE, dtype=np.float64)
+    return sample_rate, x
@@ -1,43 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-import matplotlib.pyplot as plt
+import hashlib
+import json
 import numpy as np
 import os
 import pandas as pd
-import seaborn as sns
-from sklearn.preprocessing import QuantileTransformer
 
-from defaults import DATA_PATH, MAX_INTEGER
+from defaults import DATA_PATH, MAX_INTEGER, STIMULUS_PATTERN
 
+# Columns with few distinct values, stored as categoricals.
+CATEGORICAL_COLUMNS = ['stimulus', 'condition', 'subjectNo', 'trial_type']
 
-def anova_prep(df):
-    df = df.groupby(['subjectNo', 'condition'])['response'].mean()
-    df = df.unstack()
-    tmp = []
-    for subject in df.index:
-        for condition in df.loc[subject].keys():
-            tmp.append(
-                {
-                    'subjectNo': subject,
-                    'condition': condition,
-                    'rating': df.loc[subject, condition],
-                }
-            )
-    return pd.DataFrame(tmp)
+# Columnar caches of parsed CSVs (see `read_cached`).
+CACHE_PATH = os.path.join(DATA_PATH, '.cache')
 
 
-def average_condition_rating_within_subject(df):
-    tmp = df.groupby(['subjectNo', 'condition'])['response'].mean()
-    return tmp.unstack()
+def anova_prep(df, ratings=None):
+    """Long (subjectNo, condition, rating) table of mean ratings.
 
+    One row per subject and condition, subject-major; conditions a subject
+    never rated get a NaN rating.
+    """
+    ratings = average_condition_rating_within_subject(df, ratings)
+    ratings = ratings.melt(
+        ignore_index=False, var_name='condition', value_name='rating')
+    return ratings.sort_index(kind='stable').reset_index()
 
-def average_std_of_ratings(df):
-    return df.groupby(['subjectNo', 'condition'])['response'].std().\
-        groupby('condition').mean()
 
+def average_condition_rating_within_subject(df, ratings=None):
+    if ratings is None:
+        ratings = subject_condition_ratings(df)
+    return ratings['mean'].unstack()
 
-def box_plot(df, study_type, savefig=False, dpi=300):
-    tmp = df.groupby(['subjectNo', 'condition'])['response'].mean()
-    tmp = tmp.unstack()
+
+def average_std_of_ratings(df, ratings=None):
+    if ratings is None:
+        ratings = subject_condition_ratings(df)
+    return ratings['std'].groupby(level='condition', observed=True).mean()
+
+
+def box_plot(df, study_type, savefig=False, dpi=300, ratings=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    tmp = average_condition_rating_within_subject(df, ratings)
     tmp.columns = [s.replace('_', ' ') for s in tmp.columns]
     plt.figure(figsize=(16, 6))
     sns.boxplot(data=tmp)
@@ -51,17 +57,24 @@ def box_plot(df, study_type, savefig=False, dpi=300):
 
 def extract_condition(df):
     if 'condition' not in df:
-        def process(x):
-            return "_".join(x[-1].split('_')[:-1])
+        df['condition'] = parse_stimulus_paths(df['stimulus'])['condition']
+    return df
 
-        df['condition'] = df['stimulus'].str.split('/').apply(process)
+
+def extract_stimulus_fields(df):
+    """
+    Add subjectNo, block, condition and repeat columns parsed from paths.
+    """
+    fields = parse_stimulus_paths(df['stimulus'])
+    for column in fields:
+        if column not in df:
+            df[column] = fields[column]
     return df
 
 
 def extract_subject(df):
     if 'subjectNo' not in df:
-        df['subjectNo'] = df['stimulus'].str.split("/").apply(
-            lambda x: x[1].split("_")[1])
+        df['subjectNo'] = parse_stimulus_paths(df['stimulus'])['subjectNo']
     return df
 
 
@@ -73,8 +86,8 @@ def extract_trials(df):
 
 def filter_by_basic(df, threshold=0.6):
     """Find subjectNo where the BASIC condition was rated below threshold."""
-    tmp1 = df[df['condition'] == 'BASIC'].groupby(['subjectNo'])[
-               'response'].min() > threshold
+    tmp1 = df[df['condition'] == 'BASIC'].groupby(
+        ['subjectNo'], observed=True)['response'].min() > threshold
     tmp2 = tmp1[tmp1]
     print(f"N = {len(tmp2)}")
     return df[df['subjectNo'].isin(tmp2.keys())]
@@ -82,8 +95,8 @@ def filter_by_basic(df, threshold=0.6):
 
 def filter_by_control(df, threshold=0.6):
     """Find subjectNo where the CONTROL was rated greater than threshold."""
-    tmp1 = df[df['condition'] == 'CONTROL'].groupby(['subjectNo'])[
-               'response'].min() > threshold
+    tmp1 = df[df['condition'] == 'CONTROL'].groupby(
+        ['subjectNo'], observed=True)['response'].min() > threshold
     tmp2 = tmp1[tmp1]
     print(f"N = {len(tmp2)}")
     return df[df['subjectNo'].isin(tmp2.keys())]
@@ -93,14 +106,9 @@ def get_good_participants(num_reject=2):
     """Filter participants by number of rejections"""
 
     pattern = os.path.join(DATA_PATH, 'participant_demographic_data/*.csv')
-    files = glob(pattern)
-
-    df = pd.DataFrame()
+    files = sorted(glob(pattern))
 
-    for i, file in enumerate(files):
-        tmp = pd.read_csv(file)
-        tmp['phase'] = i
-        df = df.append(tmp)
+    df = read_csvs(files, source_column='phase')
 
     return df.query(f'status == "APPROVED" and num_rejections <= {num_reject}')[
         'participant_id']
@@ -110,17 +118,36 @@ def get_num_subjects(df):
     return len(df['subjectNo'].unique())
 
 
-def get_summary(df):
-    tmp1 = df[['condition', 'response']].groupby('condition').mean()
-    tmp2 = df[['condition', 'response']].groupby('condition').std()
+def get_summary(df, ratings=None):
+    """Mean and std of all ratings per condition.
+
+    Pooled from the subject x condition counts, means and stds, so the
+    trials are not grouped again.
+    """
+    if ratings is None:
+        ratings = subject_condition_ratings(df)
+    grouped = ratings.groupby(level='condition', observed=True)
+
+    count = grouped['count'].sum()
+    mean = (ratings['count'] * ratings['mean']).groupby(
+        level='condition', observed=True).sum() / count
+
+    # Within-cell plus between-cell sums of squares (ddof=1, as pandas).
+    deviation = ratings['mean'] - mean.reindex(
+        ratings.index.get_level_values('condition')).to_numpy()
+    squares = ((ratings['count'] - 1) * ratings['std'] ** 2).fillna(0) \
+        + ratings['count'] * deviation ** 2
+    squares = squares.groupby(level='condition', observed=True).sum()
 
     tmp3 = pd.DataFrame()
-    tmp3['mean'] = tmp1['response']
-    tmp3['std'] = tmp2['response']
+    tmp3['mean'] = mean
+    tmp3['std'] = np.sqrt(squares / (count - 1))
     return tmp3
 
 
 def group_quantile_transform(series):
+    from sklearn.preprocessing import QuantileTransformer
+
     quantiler = QuantileTransformer()
     return np.squeeze(quantiler.fit_transform(series.values.reshape(-1, 1)))
 
@@ -130,18 +157,22 @@ def isolate_study(df, study_type):
     return df[df['studyType'] == study_type]
 
 
-def load(pattern='prolific/*.csv'):
-    pattern = os.path.join(DATA_PATH, pattern)
+def load(pattern='prolific/*.csv', datapath=DATA_PATH, use_cache=True,
+         num_workers=None):
+    """
+    Read all CSVs matching `pattern`, via a columnar cache when possible.
+    """
+    pattern = os.path.join(datapath, pattern)
 
-    files = glob(pattern)
+    files = sorted(glob(pattern))
     assert files, 'No csv data found.'
 
-    df = pd.DataFrame()
-
-    for file in files:
-        df = df.append(pd.read_csv(file))
+    def read():
+        return to_categoricals(read_csvs(files, num_workers=num_workers))
 
-    return df
+    if not use_cache:
+        return read()
+    return read_cached(files, read, os.path.join(datapath, '.cache'))
 
 
 def load_and_clean_data(num_reject=10000):
@@ -156,11 +187,10 @@ def load_and_clean_data(num_reject=10000):
     gp = get_good_participants(num_reject=num_reject)
     df = df[df['prolificID'].isin(gp)]
 
-    df = df.reset_index(drop=True)
+    df = to_categoricals(df.reset_index(drop=True))
     return df.drop(
-        ['view_history', 'trial_type', 'internal_node_id', 'studyID',
-         'sessionID', 'url', 'slider_start'],
-        1
+        columns=['view_history', 'trial_type', 'internal_node_id', 'studyID',
+                 'sessionID', 'url', 'slider_start'],
     )
 
 
@@ -195,12 +225,13 @@ def load_tt_descriptors():
 
 def max_time_elapsed(df):
     """Returns the max time elapsed in minutes."""
-    return df.groupby('subjectNo')['time_elapsed'].max() / 1000 / 60
+    max_ = df.groupby('subjectNo', observed=True)['time_elapsed'].max()
+    return max_ / 1000 / 60
 
 
 def min_max_norm(df):
-    min_ = df.groupby('subjectNo')['response'].transform('min')
-    max_ = df.groupby('subjectNo')['response'].transform('max')
+    min_ = df.groupby('subjectNo', observed=True)['response'].transform('min')
+    max_ = df.groupby('subjectNo', observed=True)['response'].transform('max')
     df['response'] = (df['response'] - min_) / (max_ - min_)
     return df
 
@@ -213,9 +244,99 @@ def normalize_slider(df):
     return df
 
 
-def response_histograms(df, bins=20):
+def parse_stimulus_paths(stimulus):
+    """Parse subjectNo, block, condition and repeat from stimulus paths.
+
+    Each path occurs once per response, so only the unique paths are
+    matched (one compiled-regex `str.extract`), then broadcast back to the
+    rows by their codes. Returns categorical columns aligned with
+    `stimulus`; paths that don't match give NaN.
+    """
+    if stimulus.dtype == 'category':
+        codes = stimulus.cat.codes.to_numpy()
+        uniques = pd.Series(stimulus.cat.categories)
+    else:
+        codes, uniques = pd.factorize(stimulus)
+        uniques = pd.Series(uniques)
+
+    fields = uniques.astype(str).str.extract(STIMULUS_PATTERN)
+
+    out_ = pd.DataFrame(index=stimulus.index)
+    for column in fields:
+        parsed = pd.Categorical(fields[column])
+        row_codes = np.where(codes >= 0, parsed.codes[codes], -1)
+        out_[column] = pd.Categorical.from_codes(row_codes, parsed.categories)
+    return out_
+
+
+def read_cached(files, read, cache_path=CACHE_PATH):
+    """Return `read()`, cached on disk until any of `files` changes.
+
+    The cache is Parquet (keeps categoricals, loads in a fraction of the CSV
+    parse time), or a pickle if no Parquet engine is installed or the frame
+    can't be stored as Parquet (e.g. mixed-type object columns). It is keyed
+    by the file list and invalidated by any change in their mtimes or sizes.
+    """
+    key = hashlib.sha1('\n'.join(files).encode('utf-8')).hexdigest()[:12]
+    manifest_path = os.path.join(cache_path, f"{key}.json")
+
+    manifest = {
+        'files': {
+            f: [os.stat(f).st_mtime_ns, os.stat(f).st_size] for f in files
+        }
+    }
+
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as handle:
+            cached = json.load(handle)
+        cache_file = os.path.join(cache_path, cached.get('cache', ''))
+        if cached['files'] == manifest['files'] and os.path.isfile(cache_file):
+            if cache_file.endswith('.parquet'):
+                return pd.read_parquet(cache_file)
+            return pd.read_pickle(cache_file)
+
+    df = read()
+
+    os.makedirs(cache_path, exist_ok=True)
+    parquet_path = os.path.join(cache_path, f"{key}.parquet")
+    try:
+        manifest['cache'] = f"{key}.parquet"
+        df.to_parquet(parquet_path)
+    except (ImportError, ValueError, TypeError):
+        # pyarrow's conversion errors subclass ValueError and TypeError.
+        if os.path.isfile(parquet_path):
+            os.remove(parquet_path)
+        manifest['cache'] = f"{key}.pickle"
+        df.to_pickle(os.path.join(cache_path, manifest['cache']))
+
+    # Written last, so an interrupted write leaves the cache invalid.
+    with open(manifest_path, 'w') as handle:
+        json.dump(manifest, handle)
+
+    return df
+
+
+def read_csvs(files, num_workers=None, source_column=None):
+    """
+    Read CSVs in parallel and concatenate them once.
+
+    If `source_column` is given, it records each row's index into `files`.
+    """
+    with ThreadPoolExecutor(num_workers) as pool:
+        frames = list(pool.map(pd.read_csv, files))
+
+    if source_column is not None:
+        for i, frame in enumerate(frames):
+            frame[source_column] = i
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def response_histograms(df, bins=20, ratings=None):
+    import matplotlib.pyplot as plt
+
     # Get subject's average rating per condition.
-    tmp = average_condition_rating_within_subject(df)
+    tmp = average_condition_rating_within_subject(df, ratings)
     for i, col in enumerate(tmp):
         plt.subplot(1, 2, (i % 2) + 1)
         plt.title(col)
@@ -224,8 +345,115 @@ def response_histograms(df, bins=20):
             plt.show()
 
 
+def subject_condition_ratings(df):
+    """Count, mean and std of the responses per (subjectNo, condition).
+
+    The summary and plot helpers derive everything from this; compute it
+    once per cleaned DataFrame and pass it to them as `ratings` to skip
+    grouping the trials again for each.
+    """
+    return df.groupby(['subjectNo', 'condition'], observed=True)[
+        'response'].agg(['count', 'mean', 'std'])
+
+
+def to_categoricals(df, columns=CATEGORICAL_COLUMNS):
+    """
+    Cast whichever of `columns` are present to categoricals.
+    """
+    for column in columns:
+        if column in df and df[column].dtype != 'category':
+            df[column] = df[column].astype('category')
+    return df
+
+
 def within_subject_correlation(_df, _feature, _method):
     """Group by subject, get correlation with response, mean over subjects."""
-    return _df.groupby('subjectNo')[_feature].corr(
-        _df['response'], method=_method
-    ).mean()
+    return within_subject_correlations(_df, [_feature], _method).iloc[0]
+
+
+def within_subject_correlations(
+        df,
+        features,
+        method='pearson',
+        chunk_size=4096,
+):
+    """Subject-averaged correlation of every feature with the response.
+
+    Rows are sorted by subject once, so each subject is a contiguous block
+    and all per-subject sums are `np.add.reduceat` calls over a chunk of
+    features at a time (`chunk_size` bounds memory). Responses and features
+    are centred within subject; 'spearman' ranks them within subject first.
+    Subjects where a feature is constant are skipped, as with pandas.
+
+    Args:
+        df: Trials, with 'subjectNo' and 'response' columns.
+        features: List of column names, or an array (trials x features)
+            aligned with the rows of `df`, e.g. stacked, flattened STRFs.
+        method: 'pearson' or 'spearman'.
+        chunk_size: Number of features processed at once.
+
+    Returns:
+        Series indexed by column name, or an array for array input.
+    """
+    assert method in ['pearson', 'spearman']
+
+    codes, _ = pd.factorize(df['subjectNo'])
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    counts = np.diff(np.r_[starts, len(codes)])
+
+    def centre(x):
+        means = np.add.reduceat(x, starts, axis=0) / counts.reshape(
+            -1, *[1] * (x.ndim - 1))
+        return x - np.repeat(means, counts, axis=0)
+
+    def rank(x):
+        return pd.DataFrame(x).groupby(codes).rank().to_numpy()
+
+    response = df['response'].to_numpy(dtype=float)[order]
+    if method == 'spearman':
+        response = rank(response[:, None])[:, 0]
+    response = centre(response)
+    response_ss = np.add.reduceat(response ** 2, starts)
+
+    if isinstance(features, (list, tuple, pd.Index)):
+        names = list(features)
+        num_features = len(names)
+
+        def get_chunk(start, stop):
+            return df[names[start:stop]].to_numpy(dtype=float)[order]
+    else:
+        names = None
+        features = np.asarray(features)
+        num_features = features.shape[1]
+
+        def get_chunk(start, stop):
+            return features[order, start:stop].astype(float)
+
+    out_ = np.empty(num_features)
+
+    for start in range(0, num_features, chunk_size):
+        stop = min(start + chunk_size, num_features)
+
+        x = get_chunk(start, stop)
+        if method == 'spearman':
+            x = rank(x)
+        x = centre(x)
+
+        numerator = np.add.reduceat(x * response[:, None], starts, axis=0)
+        feature_ss = np.add.reduceat(x ** 2, starts, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlations = numerator / np.sqrt(
+                feature_ss * response_ss[:, None])
+
+            # Constant within a subject -> undefined (NaN), skipped in mean.
+            undefined = (feature_ss == 0) | (response_ss[:, None] == 0)
+            correlations[undefined] = np.nan
+            out_[start:stop] = np.nanmean(correlations, axis=0)
+
+    if names is not None:
+        return pd.Series(out_, index=names)
+    return out_
@@ -5,6 +5,7 @@ Note, users will have to specify their own path to the Timbre Toolbox.
 """
 
 import os
+import re
 
 
 class RealPath:
@@ -37,3 +38,10 @@ ANA_PATH = real_path('../audio/ana')
 SYN_PATH = real_path('../audio/syn')
 DATA_PATH = real_path('../data')
 TIMBRE_TOOLBOX_PATH = real_path('../matlab/timbretoolbox')
+
+# Stimulus paths look like `audio/subject_<n>/block_<b>/<CONDITION>_<r>.wav`.
+STIMULUS_PATTERN = re.compile(
+    r'^[^/]*/[^/_]*_(?P<subjectNo>[^/_]+)'
+    r'/block_(?P<block>[^/]+)'
+    r'/(?P<condition>[^/]+)_(?P<repeat>[^/_]+)\.wav$'
+)
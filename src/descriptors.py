@@ -0,0 +1,169 @@
+"""
+Native NumPy versions of the Timbre Toolbox descriptors used in this project.
+
+Mirrors `matlab/timbretoolbox/pyTimbre.m`: frame energy, spectral centroid,
+crest and flatness on a power STFT, and the odd/even ratio on a harmonic
+representation. Every function works along the last axis, so a batch of
+equal-length stimuli (stimuli x samples) is processed in one pass.
+"""
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from defaults import EPS
+
+# Timbre Toolbox defaults for the STFT representation (in seconds).
+STFT_WIN_SIZE = 0.0232
+STFT_HOP_SIZE = 0.0058
+
+# Harmonic representation: a longer window to resolve individual partials.
+HARMONIC_WIN_SIZE = 0.1
+HARMONIC_HOP_SIZE = 0.025
+NUM_HARMONICS = 20
+
+# Search range for the fundamental when it is not given.
+F0_MIN = 50
+F0_MAX = 1000
+
+
+def estimate_f0(x: np.ndarray, sr: int, f0_min=F0_MIN, f0_max=F0_MAX):
+    """
+    Global f0 per signal from the peak of the (FFT) autocorrelation.
+    """
+    x = x - x.mean(axis=-1, keepdims=True)
+    nfft = 2 ** int(np.ceil(np.log2(2 * x.shape[-1])))
+
+    spectrum = np.fft.rfft(x, nfft, axis=-1)
+    autocorrelation = np.fft.irfft(np.abs(spectrum) ** 2, nfft, axis=-1)
+
+    lag_min = int(sr / f0_max)
+    lag_max = int(sr / f0_min)
+    lag = lag_min + np.argmax(autocorrelation[..., lag_min:lag_max], axis=-1)
+
+    return sr / lag
+
+
+def frame_energy(power: np.ndarray):
+    return power.sum(axis=-1)
+
+
+def frames(x: np.ndarray, win_size: int, hop_size: int):
+    """
+    Strided (..., frames, win_size) view of `x`; no copy.
+    """
+    return sliding_window_view(x, win_size, axis=-1)[..., ::hop_size, :]
+
+
+def harmonic_amplitudes(
+        x: np.ndarray,
+        sr: int,
+        f0=None,
+        num_harmonics=NUM_HARMONICS,
+        win_size=HARMONIC_WIN_SIZE,
+        hop_size=HARMONIC_HOP_SIZE,
+):
+    """
+    Per-frame partial amplitudes (..., frames, harmonics).
+
+    Each partial is the spectral peak within a quarter of f0 of its expected
+    position `k * f0`. A batch is gathered in one fancy-indexing operation
+    over the widest search window, then masked per signal.
+    """
+    if f0 is None:
+        f0 = estimate_f0(x, sr)
+    f0 = np.asarray(f0, dtype=float)
+
+    magnitude, freqs = stft(x, sr, win_size, hop_size, power=False)
+    df = freqs[1]
+
+    half_width = np.maximum(1, (0.25 * f0 / df).astype(int))
+    offsets = np.arange(-half_width.max(), half_width.max() + 1)
+
+    harmonics = np.arange(1, num_harmonics + 1)
+    centres = np.round(f0[..., None] * harmonics / df).astype(int)
+    indices = np.clip(centres[..., None] + offsets, 0, len(freqs) - 1)
+
+    # Gather (..., frames, harmonics * search), then max over the search.
+    gathered = np.take_along_axis(
+        magnitude, indices.reshape(*indices.shape[:-2], 1, -1), axis=-1
+    )
+    gathered = gathered.reshape(*magnitude.shape[:-1], num_harmonics, -1)
+
+    # Each signal only searches its own width (magnitudes are >= 0).
+    in_band = np.abs(offsets) <= half_width[..., None]
+    gathered *= in_band[..., None, None, :]
+
+    return gathered.max(axis=-1)
+
+
+def odd_even_ratio(amplitudes: np.ndarray):
+    """
+    Energy of odd partials (fundamental included) over that of even partials.
+    """
+    odd = (amplitudes[..., 0::2] ** 2).sum(axis=-1)
+    even = (amplitudes[..., 1::2] ** 2).sum(axis=-1)
+    return odd / (even + EPS)
+
+
+def spectral_centroid(power: np.ndarray, freqs: np.ndarray):
+    return (power * freqs).sum(axis=-1) / (power.sum(axis=-1) + EPS)
+
+
+def spectral_crest(power: np.ndarray):
+    return power.max(axis=-1) / (power.mean(axis=-1) + EPS)
+
+
+def spectral_flatness(power: np.ndarray):
+    geometric_mean = np.exp(np.log(power + EPS).mean(axis=-1))
+    return geometric_mean / (power.mean(axis=-1) + EPS)
+
+
+def stft(
+        x: np.ndarray,
+        sr: int,
+        win_size=STFT_WIN_SIZE,
+        hop_size=STFT_HOP_SIZE,
+        power=True,
+):
+    """
+    Hamming-windowed STFT (..., frames, bins) and its bin frequencies.
+
+    Frame and hop sizes are in seconds; the FFT is zero-padded to the next
+    power of two of the window.
+    """
+    win_length = int(round(win_size * sr))
+    hop_length = int(round(hop_size * sr))
+    nfft = 2 ** int(np.ceil(np.log2(win_length)))
+
+    window = np.hamming(win_length)
+    spectrum = np.abs(np.fft.rfft(
+        frames(x, win_length, hop_length) * window, nfft, axis=-1
+    ))
+
+    # Normalise so that a full-scale sinusoid has unit peak magnitude.
+    spectrum *= 2 / window.sum()
+
+    freqs = np.fft.rfftfreq(nfft, 1 / sr)
+
+    if power:
+        return spectrum ** 2, freqs
+    return spectrum, freqs
+
+
+def timbre_descriptors(x: np.ndarray, sr: int, f0=None):
+    """
+    The five `pyTimbre.m` descriptors, as per-frame time series.
+
+    `x` is one signal or a batch of equal-length signals (stimuli x samples).
+    Keys match `feature_extraction.timbre_toolbox`.
+    """
+    power, freqs = stft(x, sr)
+
+    return {
+        'energy': frame_energy(power),
+        'spectral_centroid': spectral_centroid(power, freqs),
+        'spectral_crest': spectral_crest(power),
+        'spectral_flatness': spectral_flatness(power),
+        'odd_even_ratio': odd_even_ratio(harmonic_amplitudes(x, sr, f0)),
+    }
@@ -2,17 +2,67 @@
 Tools for extracting timbral features from the stimuli.
 """
 
-from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-import matplotlib.pyplot as plt
-import matlab.engine
 import os
 import pandas as pd
 from tqdm import tqdm
 
-from ext.auditory import strf
-from src.defaults import DATA_PATH, TIMBRE_TOOLBOX_PATH, SYN_PATH
-from src.util import matlab2np, np2matlab, read_wav, save_pickle
+from ext.auditory import strf_summary
+from src.defaults import (DATA_PATH, SAMPLE_RATE, SYN_PATH,
+                          TIMBRE_TOOLBOX_PATH)
+from src import data_util
+from src.archive import ArchiveReader
+from src.audio_io import read_wav
+from src.descriptors import timbre_descriptors
+from src.feature_store import FeatureStore
+from src.util import save_pickle
+
+# Bump an extractor's version whenever its output changes; together with its
+# parameters this names the feature-store namespace its results live in.
+EXTRACTORS = {
+    'descriptors': {'version': 1, 'params': {}},
+    'strf': {'version': 2, 'params': {'duration': -1,
+                                      'resampler': 'polyphase'}},
+    'synthesis': {'version': 1, 'params': {}},
+    'timbre_toolbox': {'version': 1, 'params': {}},
+}
+
+# Matlab engine of this process, started on first use (see `get_matlab`).
+_eng = None
+
+# Stimulus archives mapped by this process, by path (see `get_archive`).
+_archives = {}
+
+
+def extract_features(path, extractor, archive_path=None):
+    """
+    Run one extractor on one stimulus. Executed in worker processes.
+
+    With `archive_path`, the stimulus is read from that packed archive (see
+    `archive.py`) instead of its WAV file.
+    """
+    localpath = replace_path_to_local(path)
+    params = EXTRACTORS[extractor]['params']
+
+    if extractor == 'descriptors':
+        sr, x = read_stimulus(path, archive_path)
+        return timbre_descriptors(x, sr, **params)
+    elif extractor == 'strf':
+        sr, x = read_stimulus(path, archive_path)
+        return {'strf': strf_summary(x, sr, **params)['mean']}
+    elif extractor == 'synthesis':
+        if archive_path is None:
+            return load_synthesis_descriptors(localpath)
+        descriptors = get_archive(archive_path).descriptors(path)
+        return {name: np.array(value) for name, value in descriptors.items()}
+    elif extractor == 'timbre_toolbox':
+        if archive_path is not None:
+            raise ValueError("The Timbre Toolbox reads WAV files; export them "
+                             "with `archive.export_wavs` first.")
+        return timbre_toolbox(localpath, get_matlab())
+
+    raise ValueError(f"Unknown extractor: {extractor}.")
 
 
 def extract_trials(df):
@@ -21,34 +71,78 @@ def extract_trials(df):
     return df
 
 
+def get_archive(archive_path):
+    if archive_path not in _archives:
+        _archives[archive_path] = ArchiveReader(archive_path)
+    return _archives[archive_path]
+
+
+def get_matlab():
+    global _eng
+    if _eng is None:
+        _eng = init_matlab()
+    return _eng
+
+
 def init_matlab():
+    import matlab.engine
+
     print('Starting Matlab engine...')
     eng = matlab.engine.start_matlab()
     eng.addpath(eng.genpath(TIMBRE_TOOLBOX_PATH))
     return eng
 
 
-def load(datapath=DATA_PATH):
-    pattern = os.path.join(datapath, 'prolific/*.csv')
-    files = glob(pattern)
-    assert files, 'No csv data found.'
+def join_features(df, store):
+    """
+    Join stored per-stimulus features back onto the trial table.
+    """
+    features = store.to_frame(df['stimulus'])
+    return pd.merge(df, features, on='stimulus', how='left')
 
-    df = pd.DataFrame()
 
-    for file in files:
-        df = df.append(pd.read_csv(file))
+def load(datapath=DATA_PATH):
+    return data_util.load(datapath=datapath)
 
-    return df
+
+def load_synthesis_descriptors(_path):
+    """
+    Descriptors saved at synthesis time next to a stimulus WAV (see
+    `StimulusGenerator.compute_descriptors`), skipping audio analysis.
+    """
+    descriptor_path = _path.replace('.wav', '_descriptors.npz')
+    with np.load(descriptor_path) as data:
+        return {name: data[name] for name in data.files}
 
 
-def make_modulation_representation(_path):
+def make_modulation_representation(_path, duration=-1,
+                                   resampler='polyphase'):
     """
-    Return time-averaged, complex valued STRF. (freq x scale x rate)
+    Return time-averaged STRF magnitude. (freq x scale x rate)
     """
     sr, x = read_wav(_path)
-    tmp = strf(x, sr, duration=-1)
-    tmp = np.abs(tmp)
-    return np.mean(tmp, axis=0)
+    return strf_summary(x, sr, duration=duration, resampler=resampler)['mean']
+
+
+def open_store(extractor, root=os.path.join(DATA_PATH, 'features')):
+    """
+    Feature store for the current version and parameters of `extractor`.
+    """
+    config = EXTRACTORS[extractor]
+    return FeatureStore(root, extractor, config['version'], config['params'])
+
+
+def read_stimulus(path, archive_path=None):
+    """
+    (sample rate, signal) of a stimulus, from its WAV file or, zero-copy up
+    to the float conversion, from a packed archive.
+    """
+    if archive_path is None:
+        return read_wav(replace_path_to_local(path))
+
+    archive = get_archive(archive_path)
+    assert archive.sample_rate == SAMPLE_RATE, 'Archive needs resampling.'
+    return archive.sample_rate, archive.signal(path)
 
 
 def replace_path_to_local(_path):
@@ -64,10 +158,54 @@ def replace_path_to_local(_path):
     return os.path.join(tmp, file_)
 
 
+def run_extraction(paths, extractor, store, num_workers=None,
+                   archive_path=None):
+    """
+    Compute `extractor` once per unique stimulus content in `paths`.
+
+    Stimuli are sharded across a process pool; each worker builds its own
+    filter banks (or Matlab engine) on first use. Results are written to
+    `store` as they arrive, keyed by file content, so reruns (e.g. after a
+    crash) skip everything already computed. With `archive_path`, stimuli
+    are read from a packed archive and keyed by their PCM samples instead.
+    """
+    unique_paths = pd.unique(pd.Series(paths))
+
+    if archive_path is None:
+        def content_hash(path):
+            return FeatureStore.content_hash(replace_path_to_local(path))
+    else:
+        content_hash = get_archive(archive_path).content_hash
+
+    todo = {}
+    for path in unique_paths:
+        key = content_hash(path)
+        if key in store:
+            store.link(path, key)
+        else:
+            todo.setdefault(key, []).append(path)
+
+    print(f"{len(unique_paths)} unique stimuli, {len(todo)} to compute...")
+
+    with ProcessPoolExecutor(num_workers) as pool:
+        futures = {
+            pool.submit(extract_features, paths_[0], extractor,
+                        archive_path): key
+            for key, paths_ in todo.items()
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            key = futures[future]
+            store.put(key, future.result())
+            for path in todo[key]:
+                store.link(path, key)
+
+
 def timbre_toolbox(filepath, _eng):
     """
-    Coupled to script `pyTimbre.m`
+    Coupled to script `pyTimbre.m`. Reference for the native 'descriptors'
+    extractor (see `descriptors.py`), which needs no Matlab engine.
     """
+    from src.matlab_bridge import matlab2np
 
     _data = _eng.pyTimbre(filepath, nargout=5)
 
@@ -89,55 +227,31 @@ def timbre_toolbox(filepath, _eng):
 
 if __name__ == '__main__':
 
-    # Flags.
-    use_timbre_toolbox = False
-    use_auditory_model = True
+    # Extractors to run, and the pickle each one is joined into.
+    extractors = {
+        'descriptors': 'descriptor_features.pickle',
+        'strf': 'modulation_features.pickle',
+        # 'timbre_toolbox': 'TT_features.pickle',
+    }
 
-    # Pickle file paths.
-    timbretoolbox_name = 'TT_features.pickle'
-    timbretoolbox_pickle_path = os.path.join(DATA_PATH, timbretoolbox_name)
+    # Worker processes (None uses every core).
+    num_workers = None
 
-    auditory_name = 'modulation_features.pickle'
-    auditory_pickle_path = os.path.join(DATA_PATH, auditory_name)
-
-    # Generate data.
-    eng = init_matlab()
+    # Packed stimulus archive to read from, instead of the WAV files (see
+    # `output_format` in `build_stimuli.py`).
+    archive_path = None
 
     df = load()
     df = extract_trials(df)
 
-    paths = df['stimulus'].tolist()
-
-    all_tt_data = []
-    all_aud_data = []
-
-    for path in tqdm(paths):
-        localpath = replace_path_to_local(path)
-
-        if use_timbre_toolbox:
-            tt_data = timbre_toolbox(localpath, eng)
-            tt_data['stimulus'] = path
-
-            all_tt_data.append(tt_data)
-
-        if use_auditory_model:
-            aud_data = dict()
-            aud_data['strf'] = make_modulation_representation(localpath)
-            aud_data['stimulus'] = path
-
-            all_aud_data.append(aud_data)
-
-    if use_timbre_toolbox:
-        save_pickle(timbretoolbox_pickle_path, all_tt_data, force=False)
-    if use_auditory_model:
-        save_pickle(auditory_pickle_path, all_aud_data, force=False)
-
-    # if debug:
-    #     from src.util import load_pickle
-    #     import pandas as pd
-    #
-    #     tmp = load_pickle(pickle_path)
-    #     tmp = pd.DataFrame(tmp)
-    #
-    #     test = pd.merge(tmp, df, on='stimulus')
-    #     print(test)
+    for extractor, pickle_name in extractors.items():
+        store = open_store(extractor)
+        run_extraction(df['stimulus'], extractor, store, num_workers,
+                       archive_path)
+
+        # Replaced atomically, so a rerun refreshes it and a crash never
+        # leaves a truncated pickle.
+        pickle_path = os.path.join(DATA_PATH, pickle_name)
+        save_pickle(pickle_path + '.tmp', join_features(df, store),
+                    force=True)
+        os.replace(pickle_path + '.tmp', pickle_path)
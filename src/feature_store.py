@@ -0,0 +1,159 @@
+"""
+Resumable, content-addressed on-disk store for per-stimulus features.
+
+Items are keyed by the SHA-256 of the stimulus file, inside a namespace named
+after the extractor, its version and a hash of its parameters; changing any
+of those starts a fresh namespace instead of mixing results. Each item is a
+directory of `.npy` arrays, written to a temporary directory and renamed into
+place, so a crash never leaves a half-written item behind. Arrays can be
+memory-mapped, and readers may load only the features they need.
+
+    <root>/<extractor>-v<version>-<params hash>/
+        index.jsonl                 stimulus path -> content hash
+        <hash[:2]>/<hash>/<name>.npy
+"""
+
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+
+class FeatureStore:
+    """
+    Content-addressed feature store for one extractor configuration.
+    """
+    def __init__(
+            self,
+            root: str,
+            extractor: str,
+            version: int = 1,
+            params: dict = None,
+    ):
+        params = params or {}
+        params_hash = hashlib.sha256(
+            json.dumps(params, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:12]
+
+        self.extractor = extractor
+        self.version = version
+        self.params = params
+
+        self.path = os.path.join(root, f"{extractor}-v{version}-{params_hash}")
+        os.makedirs(self.path, exist_ok=True)
+
+        self.index_path = os.path.join(self.path, 'index.jsonl')
+        self._index = self._read_index()
+
+    @staticmethod
+    def content_hash(filepath: str, block_size: int = 2**20) -> str:
+        """
+        SHA-256 of a file's bytes.
+        """
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as handle:
+            for block in iter(lambda: handle.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _item_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isdir(self._item_path(key))
+
+    def __len__(self) -> int:
+        return len(set(self._index.values()))
+
+    def put(self, key: str, features: dict):
+        """
+        Atomically write one item. A no-op if `key` is already stored.
+        """
+        if key in self:
+            return
+
+        parent = os.path.dirname(self._item_path(key))
+        os.makedirs(parent, exist_ok=True)
+
+        tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+        try:
+            for name, value in features.items():
+                np.save(os.path.join(tmp_path, f"{name}.npy"),
+                        np.asarray(value))
+            os.rename(tmp_path, self._item_path(key))
+        except OSError:
+            # Lost a race with another writer (or failed to write): keep the
+            # item that is already in place, if any.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if key not in self:
+                raise
+
+    def get(self, key: str, names=None, mmap: bool = True) -> dict:
+        """
+        Load an item's arrays (all, or only `names`), memory-mapped if asked.
+        """
+        item_path = self._item_path(key)
+        if names is None:
+            names = [f[:-4] for f in os.listdir(item_path) if f.endswith('.npy')]
+
+        mmap_mode = 'r' if mmap else None
+        return {
+            name: np.load(os.path.join(item_path, f"{name}.npy"),
+                          mmap_mode=mmap_mode)
+            for name in names
+        }
+
+    def _read_index(self) -> dict:
+        index = {}
+        if not os.path.isfile(self.index_path):
+            return index
+
+        with open(self.index_path) as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from an interrupted run.
+                    continue
+                index[entry['stimulus']] = entry['key']
+        return index
+
+    def link(self, stimulus: str, key: str):
+        """
+        Record that `stimulus` (a path as used in the trial table) has `key`.
+        """
+        if self._index.get(stimulus) == key:
+            return
+
+        with open(self.index_path, 'a') as handle:
+            handle.write(json.dumps({'stimulus': stimulus, 'key': key}) + '\n')
+        self._index[stimulus] = key
+
+    def key_of(self, stimulus: str):
+        return self._index.get(stimulus)
+
+    def to_frame(self, stimuli=None, names=None, mmap: bool = True):
+        """
+        One row per unique stimulus (default: every linked stimulus).
+
+        Stimuli without stored features are left out, so a left join onto
+        the trial table gives them NaN.
+        """
+        if stimuli is None:
+            stimuli = list(self._index)
+
+        records = []
+        for stimulus in pd.unique(pd.Series(stimuli)):
+            key = self._index.get(stimulus)
+            if key is None or key not in self:
+                continue
+            record = self.get(key, names, mmap)
+            record['stimulus'] = stimulus
+            records.append(record)
+
+        if not records:
+            return pd.DataFrame(columns=['stimulus'])
+        return pd.DataFrame(records)
@@ -0,0 +1,110 @@
+"""
+Cached filter design and streaming filters.
+
+Butterworth designs are stored as second-order sections, which stay stable at
+the high orders used for smoothing pitch tracks, and are cached per
+(order, cutoff, rate) so repeated calls skip the design step.
+"""
+
+import math
+import numpy as np
+
+from functools import lru_cache
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt, sosfreqz
+
+from defaults import EPS
+
+
+@lru_cache(maxsize=64)
+def butter_sos(order: int, cutoff: float, sample_rate: float) -> np.ndarray:
+    """
+    Butterworth lowpass as second-order sections. Cached; do not modify.
+    """
+    Wn = cutoff / (sample_rate / 2)
+    return butter(order, Wn, btype='lowpass', output='sos')
+
+
+@lru_cache(maxsize=64)
+def dc_group_delay(order: int, cutoff: float, sample_rate: float) -> float:
+    """
+    Group delay (in samples) of the cached lowpass, near DC.
+    """
+    # Slope of the phase response over a small band above DC.
+    w = np.array([0., 0.01]) * math.pi * cutoff / (sample_rate / 2)
+    _, h = sosfreqz(butter_sos(order, cutoff, sample_rate), worN=w)
+    return float(-np.diff(np.unwrap(np.angle(h)))[0] / w[1])
+
+
+def low_pass(
+        signal: np.ndarray,
+        frequency: float,
+        sample_rate: int,
+        order: int = 16
+) -> np.ndarray:
+    """
+    Zero-phase butterworth lowpass filter.
+    """
+    sos = butter_sos(order, frequency, sample_rate)
+    return sosfiltfilt(sos, signal)
+
+
+class EnvelopeFollower:
+    """
+    Block-wise amplitude envelope: full-wave rectifier and causal lowpass.
+
+    The rectified mean of a sinusoid is 2/pi of its amplitude, so the output
+    is rescaled to read like the Hilbert envelope for steady tones.
+    """
+    def __init__(
+            self,
+            cutoff: float = 25.,
+            sr: int = 44100,
+            order: int = 4,
+    ):
+        assert 0 < cutoff < sr / 2
+        self.sos = butter_sos(order, cutoff, sr)
+        self.delay = dc_group_delay(order, cutoff, sr)
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def __call__(self, block: np.ndarray) -> np.ndarray:
+        rectified = np.abs(block)
+
+        if self.zi is None:
+            # Start from steady state on the first value, like `filtfilt`.
+            self.zi = sosfilt_zi(self.sos) * rectified[0]
+
+        out_, self.zi = sosfilt(self.sos, rectified, zi=self.zi)
+        return out_ * (math.pi / 2)
+
+
+def find_onset(
+    signal: np.ndarray,
+    threshold: float = -35,
+    cutoff: float = 25.,
+    sr: int = 44100,
+    block_size: int = 4096,
+):
+    """
+    First sample whose log-envelope reaches `threshold`, or None.
+
+    Reads the signal in blocks and stops at the first block that crosses, so
+    only the head of the file is filtered. The DC group delay of the causal
+    filter is compensated for, but not the lead of a zero-phase envelope:
+    on a sharp attack crossed near its top (e.g. -5) the onset can be tens
+    of milliseconds later than `util.trim_silence` finds it. Close only on
+    slow ramps or at thresholds well below the signal's level.
+    """
+    follower = EnvelopeFollower(cutoff, sr)
+
+    for start in range(0, len(signal), block_size):
+        envelope = follower(signal[start:start + block_size])
+        crossings = np.flatnonzero(np.log(envelope + EPS) >= threshold)
+
+        if crossings.size:
+            index = start + crossings[0] - int(round(follower.delay))
+            return max(index, 0)
+
+    return None
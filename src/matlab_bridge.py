@@ -0,0 +1,32 @@
+"""
+Conversions between numpy and the Matlab engine.
+
+Only needed when talking to the Timbre Toolbox, so `matlab` is never imported
+by the synthesis path.
+"""
+
+import matlab
+import numpy as np
+
+from typing import Union
+
+
+def matlab2np(input_: matlab.double):
+    """
+    Convert Matlab double to numpy array.
+    """
+    return np.array(input_._data)
+
+
+def np2matlab(input_: np.ndarray):
+    """
+    Convert numpy array to Matlab double.
+    """
+    return matlab.double(input_.tolist())[0]
+
+
+def num2matlab(input_: Union[float, int]):
+    """
+    Convert single value to Matlab double.
+    """
+    return matlab.double([input_])
@@ -0,0 +1,50 @@
+"""
+Plotting utilities.
+
+Kept apart from `util.py` so that matplotlib and librosa are only imported by
+processes that actually draw something.
+"""
+
+import librosa
+import librosa.display
+import matplotlib.pyplot as plt
+import numpy as np
+
+from defaults import SAMPLE_RATE
+
+
+def plot_envelope(env, show=True):
+    plt.imshow(env.T, aspect='auto', origin='lower')
+    if show:
+        plt.show()
+
+
+def stft_plot(
+    signal: np.ndarray,
+    sample_rate: int = SAMPLE_RATE,
+    title: str = "",
+    show: bool = True
+):
+    X = librosa.stft(signal)
+    Xdb = librosa.amplitude_to_db(abs(X))
+    plt.figure(figsize=(5, 5))
+    plt.title(title)
+    librosa.display.specshow(Xdb, sr=sample_rate, x_axis="time", y_axis="linear")
+    if show:
+        plt.show()
+
+
+def time_plot(
+        signal: np.ndarray,
+        rate: int = 44100,
+        show: bool = True,
+        title: str = None
+):
+    t = np.linspace(0, len(signal)/rate, len(signal), endpoint=False)
+    plt.plot(t, signal)
+    plt.xlabel('time (s)')
+    plt.ylabel('amplitude')
+    if title:
+        plt.title(title)
+    if show:
+        plt.show()
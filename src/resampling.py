@@ -0,0 +1,86 @@
+"""
+Fast resampling of control-rate envelopes to audio rate.
+
+Envelopes are sampled at `frame_rate` and evaluated at every integer audio
+sample up to (but excluding) the last input frame, exactly as
+`scipy.interpolate.interp1d(kind='linear')` over `np.arange(n) * sr / fr`
+would. Arrays may be one-dimensional (frames,) or two-dimensional
+(frames x partials); time is always the first axis.
+"""
+
+import numpy as np
+
+
+def get_num_samples(num_frames: int, frame_rate: float, sr: int) -> int:
+    """
+    Number of audio samples spanned by `num_frames` control frames.
+    """
+    return int(round((num_frames - 1) * sr / frame_rate))
+
+
+def linear_resample(
+        env: np.ndarray,
+        frame_rate: float,
+        sr: int,
+) -> np.ndarray:
+    """
+    Vectorized linear interpolation of `env` from `frame_rate` to `sr`.
+    """
+    num_frames = env.shape[0]
+    num_samples = get_num_samples(num_frames, frame_rate, sr)
+
+    if env.ndim == 1:
+        _indices = np.arange(num_frames) * sr / frame_rate
+        return np.interp(np.arange(num_samples), _indices, env)
+
+    # Fractional read position (in frames) of every output sample.
+    position = np.arange(num_samples) * (frame_rate / sr)
+
+    index = np.minimum(position.astype(np.intp), num_frames - 2)
+    fraction = position - index
+
+    # Gather and blend in place; the output dominates memory traffic.
+    out_ = np.take(env, index, axis=0)
+    slope = np.take(np.diff(env, axis=0), index, axis=0)
+    slope *= fraction[:, None]
+    out_ += slope
+
+    return out_
+
+
+def polyphase_resample(env: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Linear interpolation by an integer `factor`.
+
+    Each of the `factor` output phases is a fixed blend of two neighbouring
+    frames, so the whole output is one broadcasted product.
+    """
+    assert factor >= 1
+
+    phases = np.arange(factor) / factor
+    shape = (1, factor) + (1,) * (env.ndim - 1)
+    phases = phases.reshape(shape)
+
+    lower = env[:-1, None]
+    out_ = lower + phases * (env[1:, None] - lower)
+
+    return out_.reshape((-1,) + env.shape[1:])
+
+
+def resample(
+        env: np.ndarray,
+        frame_rate: float,
+        sr: int,
+) -> np.ndarray:
+    """
+    Resample envelope array in time, using the polyphase path if possible.
+    """
+    assert env.ndim in [1, 2], "One- or two-dimensional envelopes only."
+    assert env.shape[0] > 1, "Need at least two frames to interpolate."
+
+    ratio = sr / frame_rate
+
+    if ratio == int(ratio):
+        return polyphase_resample(env, int(ratio))
+
+    return linear_resample(env, frame_rate, sr)
@@ -59,10 +59,8 @@ import math
 import numpy as np
 
 from defaults import EPS, SAMPLE_RATE, PITCH_RATE
-from util import (
-    add_fade, midi_to_hz, normalize, plot_envelope, stft_plot, remove_dc,
-    resample
-)
+from descriptors import odd_even_ratio, spectral_centroid
+from util import add_fade, midi_to_hz, normalize, remove_dc, resample
 
 
 class StimulusGenerator:
@@ -75,6 +73,7 @@ class StimulusGenerator:
             pr: int = PITCH_RATE,
             random_rate_upper_limit: float = 12.,
             random_rate_lower_limit: float = 4.,
+            emit_descriptors: bool = False,
     ):
         assert sr > 0
         self.sr = sr
@@ -104,6 +103,10 @@ class StimulusGenerator:
 
         self.processed_env = None
 
+        # Synthesis-side descriptors, one dict per call (see `pop_descriptors`).
+        self.emit_descriptors = emit_descriptors
+        self.descriptor_history = []
+
     def __call__(
             self,
             f0: float,
@@ -174,13 +177,92 @@ class StimulusGenerator:
         # Output.
         x = self.synthesize()
         x = remove_dc(x)
+        peak = np.max(np.abs(x))
         x = normalize(x)
 
         # Fade in/out.
         x = add_fade(x, audio_fade, self.sr)
         x = add_fade(x, audio_fade, self.sr, fade_out=True)
+
+        if self.emit_descriptors:
+            self.descriptor_history.append(
+                self.compute_descriptors(peak, audio_fade)
+            )
         return x
 
+    def compute_descriptors(self, peak: float, audio_fade: float) -> dict:
+        """Per-frame harmonic descriptors, read from the synthesis state.
+
+        Partial amplitudes (`processed_env`, scaled by the output normalization
+        and fades) and instantaneous frequencies are known exactly, so no audio
+        analysis is needed. Frames are `pr` per second. Centroid and odd/even
+        ratio follow the definitions in `descriptors.py`; energy is the mean
+        signal power per frame.
+
+        Returns:
+            Dict with 'frame_rate', per-frame 'energy', 'spectral_centroid' and
+            'odd_even_ratio', and per-partial 'modulation_depth' (dB, taken
+            after `mod_hold` + `mod_fade`).
+        """
+        num_samples = self.get_num_samples()
+        hop = self.sr // self.pr
+        num_frames = num_samples // hop
+
+        def frame_mean(a):
+            a = a[:num_frames * hop]
+            return a.reshape(num_frames, hop, *a.shape[1:]).mean(axis=1)
+
+        # Output gain: normalization and linear fades, as applied to `x`.
+        gain = np.full(num_samples, 1. / peak)
+        fade_samples = int(audio_fade * self.sr)
+        if fade_samples > 0:
+            ramp = np.linspace(0, 1, fade_samples, endpoint=False)
+            gain[:fade_samples] *= ramp
+            gain[-fade_samples:] *= ramp[::-1]
+
+        # Mean power of each partial per frame (a sinusoid's is amplitude²/2).
+        if self.synth_mode == 'pam':
+            average_gains = np.mean(self.processed_env, axis=0)
+            amp_envelope = np.sum(self.processed_env, axis=1)
+
+            power = np.outer(frame_mean((gain * amp_envelope) ** 2),
+                             average_gains ** 2)
+            modulated = amp_envelope[:, None] * average_gains
+        else:
+            tmp = self.processed_env * gain[:, None]
+            tmp **= 2
+            power = frame_mean(tmp)
+            modulated = self.processed_env
+        power /= 2
+
+        harmonics = np.arange(1, self.num_partials + 1) * self.f0
+        frequencies = np.outer(frame_mean(self.get_frequency_trajectory()),
+                               harmonics)
+
+        # Depth of the fully faded-in modulation, as G_k in the module notes.
+        start = int((self.mod_hold + self.mod_fade) * self.sr)
+        if start >= num_samples:
+            start = 0
+        max_ = np.max(modulated[start:], axis=0)
+        min_ = np.min(modulated[start:], axis=0)
+
+        return {
+            'frame_rate': self.sr / hop,
+            'energy': power.sum(axis=1),
+            'spectral_centroid': spectral_centroid(power, frequencies),
+            'odd_even_ratio': odd_even_ratio(np.sqrt(power)),
+            'modulation_depth': 20 * np.log10((max_ + EPS) / (min_ + EPS)),
+        }
+
+    def pop_descriptors(self) -> dict:
+        """
+        Return (and forget) descriptors of the oldest call not yet popped.
+
+        Macros that render two stimuli per call (e.g. `macro.make_shuffle`)
+        leave two entries, popped in the order the stimuli were returned.
+        """
+        return self.descriptor_history.pop(0)
+
     def process_env(self):
 
         if self.synth_mode == 'raf':
@@ -392,6 +474,20 @@ class StimulusGenerator:
         return frequency / (self.sr // 2) * self.env.shape[1]
 
     def make_carrier(self, frequency):
+        # Apply modulation.
+        trajectory = self.get_frequency_trajectory()
+        trajectory *= frequency
+
+        # Randomize initial phase.
+        phi = 2 * np.pi * np.random.rand()
+
+        phase = np.cumsum(2 * np.pi * trajectory / self.sr) + phi
+        return np.cos(phase)
+
+    def get_frequency_trajectory(self):
+        """
+        Instantaneous frequency of the fundamental, relative to `f0`.
+        """
         t = np.arange(int(self.length * self.sr))/self.sr
 
         # Always begins at top of cycle (i.e. cos(0)), as per analysis.py.
@@ -402,14 +498,7 @@ class StimulusGenerator:
         trajectory *= self.get_depth_trajectory()
         trajectory += 1.
 
-        # Apply modulation.
-        trajectory *= frequency
-
-        # Randomize initial phase.
-        phi = 2 * np.pi * np.random.rand()
-
-        phase = np.cumsum(2 * np.pi * trajectory / self.sr) + phi
-        return np.cos(phase)
+        return trajectory
 
     def get_fm_coefficient(self):
         """
@@ -598,6 +687,8 @@ class EnvelopeMorpher:
         self._log.append(tmp_log)
 
     def show(self, zoom=None):
+        from plotting import plot_envelope
+
         tmp = self.env
 
         if zoom:
@@ -654,6 +745,7 @@ class EnvelopeMorpher:
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
     from analysis import single_cycles
+    from plotting import stft_plot
 
     # Helper.
     def get_fm_depth(_datum):
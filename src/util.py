@@ -1,23 +1,47 @@
 """
 General utilities.
+
+This module is imported by every synthesis worker, so it only depends on numpy
+at import time. SciPy is imported inside the functions that need it, and the
+plotting, Matlab and librosa helpers live in their own modules. The latter are
+still reachable as `util.<name>` and are imported on first access.
 """
 
-import librosa
-import librosa.display
-import matlab
-import matplotlib.pyplot as plt
+import importlib
 import numpy as np
 import os
 import pickle
 import warnings
 
-from librosa import load
-from scipy.interpolate import interp1d
-from scipy.signal import butter, filtfilt, hilbert
 from typing import Union
 
+import resampling
 from defaults import EPS, PITCH_RATE, SAMPLE_RATE
 
+# Helpers living in heavier modules, imported lazily on attribute access.
+_LAZY_ATTRIBUTES = {
+    'plot_envelope': 'plotting',
+    'stft_plot': 'plotting',
+    'time_plot': 'plotting',
+    'matlab2np': 'matlab_bridge',
+    'np2matlab': 'matlab_bridge',
+    'num2matlab': 'matlab_bridge',
+    'read_wav': 'audio_io',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module_name = _LAZY_ATTRIBUTES[name]
+    if __package__:
+        module_name = f"{__package__}.{module_name}"
+
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
 
 def add_fade(
     signal: np.ndarray,
@@ -74,6 +98,8 @@ def force_mono(signal: np.ndarray) -> np.ndarray:
 
 
 def get_amp_envelope(signal: np.ndarray, cutoff: float = 25., sr: int = 44100):
+    from scipy.signal import hilbert
+
     amplitude_envelope = np.abs(hilbert(signal))
     smoothed = low_pass(amplitude_envelope, cutoff, sample_rate=sr, order=4)
     return smoothed
@@ -100,24 +126,16 @@ def low_pass(
         order: int = 16
 ):
     """
-    Convenience function for butterworth lowpass filter.
+    Convenience function for butterworth lowpass filter. See `filters.py`.
     """
-    Wn = frequency/(sample_rate / 2)
-    [b, a] = butter(order, Wn, btype='lowpass')
+    import filters
 
-    out_ = filtfilt(b, a, signal)
+    out_ = filters.low_pass(signal, frequency, sample_rate, order)
     assert not contains_nan(out_), "Filtering generated NaNs."
 
     return out_
 
 
-def matlab2np(input_: matlab.double):
-    """
-    Convert Matlab double to numpy array.
-    """
-    return np.array(input_._data)
-
-
 def midi_to_hz(midi: Union[float, int, np.ndarray]) -> Union[float, np.ndarray]:
     """
     Converts from linear pitch space to Hz, where A440 = midi:69.
@@ -132,31 +150,6 @@ def normalize(x: np.ndarray) -> np.ndarray:
     return x / np.max(np.abs(x))
 
 
-def np2matlab(input_: np.ndarray):
-    """
-    Convert numpy array to Matlab double.
-    """
-    return matlab.double(input_.tolist())[0]
-
-
-def num2matlab(input_: Union[float, int]):
-    """
-    Convert single value to Matlab double.
-    """
-    return matlab.double([input_])
-
-
-def plot_envelope(env, show=True):
-    plt.imshow(env.T, aspect='auto', origin='lower')
-    if show:
-        plt.show()
-
-
-def read_wav(path: str):
-    x, sample_rate = load(path, sr=SAMPLE_RATE, dtype=np.float64)
-    return sample_rate, x
-
-
 def remove_dc(signal: np.ndarray) -> np.ndarray:
     return signal - np.mean(signal)
 
@@ -167,21 +160,9 @@ def resample(
         sr: int,
 ) -> np.ndarray:
     """
-    Resample spectral envelope array in time.
+    Resample spectral envelope array in time. See `resampling.py`.
     """
-
-    axis = -1
-    if env.ndim == 2:
-        axis = 0
-
-    _indices = np.arange(env.shape[0]) * sr / frame_rate
-    f = interp1d(_indices, env, kind='linear', axis=axis)
-
-    num_samples = int(
-        round((env.shape[0] - 1) * sr / frame_rate)
-    )
-
-    return f(np.arange(num_samples))
+    return resampling.resample(env, frame_rate, sr)
 
 
 def safe_mkdir(path):
@@ -201,37 +182,6 @@ def save_pickle(path: str, data, force: bool = False):
         pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
 
-def stft_plot(
-    signal: np.ndarray,
-    sample_rate: int = SAMPLE_RATE,
-    title: str = "",
-    show: bool = True
-):
-    X = librosa.stft(signal)
-    Xdb = librosa.amplitude_to_db(abs(X))
-    plt.figure(figsize=(5, 5))
-    plt.title(title)
-    librosa.display.specshow(Xdb, sr=sample_rate, x_axis="time", y_axis="linear")
-    if show:
-        plt.show()
-
-
-def time_plot(
-        signal: np.ndarray,
-        rate: int = 44100,
-        show: bool = True,
-        title: str = None
-):
-    t = np.linspace(0, len(signal)/rate, len(signal), endpoint=False)
-    plt.plot(t, signal)
-    plt.xlabel('time (s)')
-    plt.ylabel('amplitude')
-    if title:
-        plt.title(title)
-    if show:
-        plt.show()
-
-
 def trim_to_duration(
     signal: np.ndarray,
     time_in: float = 1.,
@@ -251,10 +201,26 @@ def trim_silence(
     threshold: float = -35,
     cutoff: float = 25.,
     sr: int = 44100,
+    streaming: bool = False,
 ) -> np.ndarray:
     """
     Trims beginning of audio signal until it passes a given threshold in dB.
+
+    The onset is read from the zero-phase Hilbert envelope of the whole
+    signal, smoothed in SOS form (see `filters.low_pass`); that is within
+    1e-5 of its peak of the b/a `filtfilt` envelope used originally, so the
+    onset only moves where the envelope grazes the threshold. With
+    `streaming`, it is found block-wise by `filters.find_onset` instead,
+    which stops at the first crossing but, being causal, can land tens of
+    milliseconds later on sharp attacks at high thresholds.
     """
+    if streaming:
+        import filters
+
+        start_index = filters.find_onset(signal, threshold, cutoff, sr)
+        assert start_index is not None, "Signal never reaches threshold."
+        return signal[start_index:]
+
     amp_envelope = get_amp_envelope(signal, cutoff, sr)
     log_envelope = np.log(amp_envelope + EPS)
     start_index = np.maximum(
@@ -269,11 +235,7 @@ def upsample(
         sr: int = SAMPLE_RATE,
         pr: int = PITCH_RATE
 ) -> np.ndarray:
-    _indices = np.arange(len(hz)) * sr / pr
-    f = interp1d(_indices, hz, kind='cubic')
-
-    num_samples = int(
-        round((len(hz) - 1) * SAMPLE_RATE / PITCH_RATE)
-    )
-
-    return f(np.arange(num_samples))
+    """
+    Linearly upsample a pitch-rate trajectory to audio rate.
+    """
+    return resampling.resample(hz, pr, sr)
@@ -0,0 +1,164 @@
+"""
+Background WAV writing for stimulus generation.
+
+Rendered signals are handed to a bounded queue and quantized and written by
+dedicated I/O threads, so synthesis of the next stimulus overlaps the disk
+write of the previous one. When the disk can't keep up the queue fills and
+`submit` blocks; the time spent blocked is reported by `stats`, to help size
+the queue (e.g. on network filesystems).
+"""
+
+import numpy as np
+import os
+import queue
+import threading
+import time
+
+from scipy.io import wavfile
+
+from defaults import SAMPLE_RATE
+
+
+def quantize(x: np.ndarray, dither=False, rng=None) -> np.ndarray:
+    """
+    Float signal in [-1, 1] to 16-bit PCM, without modifying `x`.
+
+    Samples are rounded and clipped; with `dither`, triangular (TPDF) noise
+    of +/- 1 LSB is added first.
+    """
+    amplitude = np.iinfo(np.int16).max
+
+    out_ = np.multiply(x, amplitude, dtype=np.float64)
+    if dither:
+        rng = rng or np.random.default_rng()
+        out_ += rng.random(out_.shape)
+        out_ -= rng.random(out_.shape)
+
+    np.rint(out_, out=out_)
+    np.clip(out_, -amplitude - 1, amplitude, out=out_)
+    return out_.astype(np.int16)
+
+
+class WavWriter:
+    """
+    Writes 16-bit mono WAVs from `num_threads` threads, `max_queue` deep.
+
+    `submit` keeps a reference to the array, so don't modify it afterwards.
+    Any error raised by a writer thread is re-raised by the next `submit` or
+    by `close`.
+    """
+    def __init__(
+            self,
+            sample_rate: int = SAMPLE_RATE,
+            num_threads: int = 2,
+            max_queue: int = 16,
+            dither: bool = False,
+            seed=None,
+    ):
+        self.sample_rate = sample_rate
+        self.dither = dither
+
+        # One child seed per file, in submission order, so dither is
+        # reproducible whichever thread writes the file.
+        self._seeds = np.random.SeedSequence(seed)
+
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._error = None
+        self._stats = {
+            'submitted': 0,
+            'written': 0,
+            'bytes': 0,
+            'blocked_seconds': 0.,
+            'write_seconds': 0.,
+            'max_queue_depth': 0,
+        }
+
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("WAV writer thread failed.") from self._error
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            path, data, extras, seed = item
+            try:
+                if self._error is None:
+                    self._write(path, data, extras, seed)
+            except Exception as error:
+                with self._lock:
+                    self._error = self._error or error
+
+    def _write(self, path, data, extras, seed):
+        start = time.perf_counter()
+
+        pcm = quantize(data, self.dither, np.random.default_rng(seed))
+
+        # Written aside and renamed, so a file that exists is complete.
+        tmp_path = path + '.tmp'
+        wavfile.write(tmp_path, self.sample_rate, pcm)
+        os.replace(tmp_path, path)
+
+        if extras is not None:
+            np.savez(path.replace('.wav', '_descriptors.npz'), **extras)
+
+        with self._lock:
+            self._stats['written'] += 1
+            self._stats['bytes'] += pcm.nbytes
+            self._stats['write_seconds'] += time.perf_counter() - start
+
+    def close(self):
+        """
+        Write everything still queued, stop the threads and re-raise errors.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._raise_error()
+
+    def stats(self) -> dict:
+        """
+        Counters so far: files submitted and written, PCM bytes, seconds
+        `submit` spent blocked on a full queue, summed write time across
+        threads, and the deepest the queue has been.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def submit(self, path: str, data: np.ndarray, extras: dict = None):
+        """
+        Queue `data` to be written to `path`, blocking while the queue is
+        full. `extras`, if given, are saved next to it as
+        `<name>_descriptors.npz`.
+        """
+        self._raise_error()
+
+        seed = self._seeds.spawn(1)[0] if self.dither else None
+
+        start = time.perf_counter()
+        self._queue.put((path, data, extras, seed))
+        blocked = time.perf_counter() - start
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['blocked_seconds'] += blocked
+            self._stats['max_queue_depth'] = max(
+                self._stats['max_queue_depth'], self._queue.qsize())
@@ -0,0 +1,47 @@
+"""
+Benchmark `resampling.resample` against the interp1d implementation it
+replaced, on (frames x partials) envelopes as built by `StimulusGenerator`.
+
+    python test/bench_resampling.py
+"""
+
+import numpy as np
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from scipy.interpolate import interp1d
+
+from resampling import resample
+
+
+def interp1d_resample(env, frame_rate, sr):
+    axis = 0 if env.ndim == 2 else -1
+    _indices = np.arange(env.shape[0]) * sr / frame_rate
+    f = interp1d(_indices, env, kind='linear', axis=axis)
+    num_samples = int(round((env.shape[0] - 1) * sr / frame_rate))
+    return f(np.arange(num_samples))
+
+
+if __name__ == '__main__':
+    sr = 44100
+    repeats = 5
+
+    # 2.5 s at 5 Hz from a 40-frame cycle; 70 partials. Second case is integer.
+    cases = [
+        ('2-D fractional', np.random.rand(13 * 40 + 1, 70), 40 * 5.),
+        ('2-D integer', np.random.rand(13 * 40 + 1, 70), 44100 / 220),
+        ('1-D fractional (RAF)', np.random.rand(30 * 40 + 1), 40 * 11.3),
+    ]
+
+    for name, env, frame_rate in cases:
+        old = timeit.timeit(
+            lambda: interp1d_resample(env, frame_rate, sr), number=repeats
+        ) / repeats
+        new = timeit.timeit(
+            lambda: resample(env, frame_rate, sr), number=repeats
+        ) / repeats
+        print(f"{name:>22}: interp1d {old * 1e3:8.2f} ms   "
+              f"resample {new * 1e3:8.2f} ms   x{old / new:5.1f}")
@@ -0,0 +1,142 @@
+"""
+Benchmark the batched FFT stages of the STRF model against the original
+per-slice loops, on one synthetic 2.5 s stimulus. Also checks that both give
+identical outputs.
+
+    python test/bench_strf.py
+"""
+
+import math
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ext import auditory, features, utils
+
+
+def loop_angle(compl_values):
+    real_values = np.array([x.real for x in compl_values])
+    imag_values = np.array([x.imag for x in compl_values])
+    return np.arctan2(imag_values, real_values)
+
+
+def loop_spectrum2scaletime(stft, nfft_scale):
+    mod_scale = np.zeros((stft.shape[0], nfft_scale), dtype=complex)
+    phase_scale = np.zeros((stft.shape[0], nfft_scale))
+    for i in range(stft.shape[0]):
+        mod_scale[i, :] = np.fft.fft(stft[i, :], nfft_scale)
+        phase_scale[i, :] = loop_angle(mod_scale[i, :])
+    return np.abs(mod_scale), phase_scale
+
+
+def loop_scaletime2scalerate(mod_scale, nfft_rate):
+    scale_rate = np.zeros((nfft_rate, mod_scale.shape[1]), dtype=complex)
+    phase_scale_rate = np.zeros((nfft_rate, mod_scale.shape[1]))
+    for i in range(mod_scale.shape[1]):
+        scale_rate[:, i] = np.fft.fft(mod_scale[:, i], nfft_rate)
+        phase_scale_rate[:, i] = loop_angle(scale_rate[:, i])
+    return np.abs(scale_rate), phase_scale_rate
+
+
+def loop_scalerate2cortical(stft, scaleRate, phase_scale_rate, scales, rates,
+                            num_ch_oct, sr_time, nfft_rate, nfft_scale):
+    LgtTime, LgtFreq = stft.shape
+    cortical_rep = np.zeros((LgtTime, LgtFreq, len(scales), len(rates)),
+                            dtype=complex)
+    for j, fc_rate in enumerate(rates):
+        t = np.arange(nfft_rate / 2) / sr_time * abs(fc_rate)
+        h = np.sin(2 * math.pi * t) * np.power(t, 2) * np.exp(
+            -3.5 * t) * abs(fc_rate)
+        h = h - np.mean(h)
+        STRF_rate0 = np.fft.fft(h, nfft_rate)
+        A = loop_angle(STRF_rate0[:nfft_rate // 2])
+        A[0] = 0.0
+        STRF_rate = np.absolute(STRF_rate0[:nfft_rate // 2])
+        STRF_rate = STRF_rate / np.max(STRF_rate)
+        STRF_rate = STRF_rate * np.exp(1j * A)
+        STRF_rate.resize((nfft_rate, ))
+        STRF_rate[nfft_rate // 2] = np.absolute(STRF_rate[nfft_rate // 2 + 1])
+        if (fc_rate < 0):
+            STRF_rate[1:nfft_rate] = np.matrix.conjugate(
+                np.flipud(STRF_rate[1:nfft_rate]))
+        z1 = np.zeros((nfft_rate, nfft_scale // 2), dtype=complex)
+        for m in range(nfft_scale // 2):
+            z1[:, m] = STRF_rate * scaleRate[:, m] * np.exp(
+                1j * phase_scale_rate[:, m])
+        for i in range(nfft_scale // 2):
+            z1[:, i] = np.fft.ifft(z1[:, i])
+        for i, fc_scale in enumerate(scales):
+            R1 = np.arange(nfft_scale / 2) / (
+                nfft_scale / 2) * num_ch_oct / 2 / abs(fc_scale)
+            R1 = np.power(R1, 2)
+            STRF_scale = R1 * np.exp(1 - R1)
+            z = np.zeros((LgtTime, nfft_scale // 2), dtype=complex)
+            for n in range(LgtTime):
+                temp = np.fft.ifft(STRF_scale * z1[n, :], nfft_scale)
+                z[n, :] = temp[:nfft_scale // 2]
+            cortical_rep[:, :, i, j] = z[:LgtTime, :LgtFreq]
+    return cortical_rep
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out_ = fn(*args, **kwargs)
+    return out_, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    sr = 44100
+    t = np.arange(int(2.5 * sr)) / sr
+    x = np.sin(2 * np.pi * 130.8 * t) * (1 + 0.3 * np.sin(2 * np.pi * 5 * t))
+
+    params = auditory.load_static_params()
+    scales, rates = params['scales'], params['rates']
+
+    aud = auditory.spectrogram(x, sr, duration=-1)
+    strf_args = {
+        'num_channels': 128,
+        'num_ch_oct': 24,
+        'sr_time': params['sr_time'],
+        'nfft_rate': 2 * 2**utils.nextpow2(aud.shape[0]),
+        'nfft_scale': 2 * 2**utils.nextpow2(aud.shape[1]),
+        'KIND': 2
+    }
+    nfft_rate, nfft_scale = strf_args['nfft_rate'], strf_args['nfft_scale']
+
+    (mod_a, phase_a), t_loop1 = timed(loop_spectrum2scaletime, aud, nfft_scale)
+    (mod_b, phase_b, _, _), t_fast1 = timed(
+        features.spectrum2scaletime, aud, **strf_args)
+
+    complex_scale = mod_b * np.exp(1j * phase_b)
+    (sr_a, sr_phase_a), t_loop2 = timed(
+        loop_scaletime2scalerate, complex_scale, nfft_rate)
+    (sr_b, sr_phase_b, _, _), t_fast2 = timed(
+        features.scaletime2scalerate, complex_scale, **strf_args)
+
+    cort_a, t_loop3 = timed(loop_scalerate2cortical, aud, sr_b, sr_phase_b,
+                            scales, rates, 24, params['sr_time'], nfft_rate,
+                            nfft_scale)
+    cort_b, t_fast3 = timed(features.scalerate2cortical, aud, sr_b,
+                            sr_phase_b, scales, rates, **strf_args)
+
+    for name, a, b in [('spectrum2scaletime', (mod_a, phase_a),
+                        (mod_b, phase_b)),
+                       ('scaletime2scalerate', (sr_a, sr_phase_a),
+                        (sr_b, sr_phase_b)),
+                       ('scalerate2cortical', (cort_a, ), (cort_b, ))]:
+        identical = all(np.array_equal(u, v) for u, v in zip(a, b))
+        print(f"{name:>20}: identical={identical}")
+
+    for name, slow, fast in [('spectrum2scaletime', t_loop1, t_fast1),
+                             ('scaletime2scalerate', t_loop2, t_fast2),
+                             ('scalerate2cortical', t_loop3, t_fast3)]:
+        print(f"{name:>20}: loop {slow:7.3f} s   batched {fast:7.3f} s   "
+              f"x{slow / fast:5.1f}")
+
+    total_slow = t_loop1 + t_loop2 + t_loop3
+    total_fast = t_fast1 + t_fast2 + t_fast3
+    print(f"{'per stimulus':>20}: loop {total_slow:7.3f} s   "
+          f"batched {total_fast:7.3f} s   x{total_slow / total_fast:5.1f}")
@@ -0,0 +1,90 @@
+"""
+Regenerate `timbre_reference.json`: closed-form values of the Timbre Toolbox
+descriptor definitions for synthetic signals, used by `test_descriptors.py`.
+
+This is a self-consistency check of the definitions as implemented, not
+parity with the Matlab toolbox: the values assume `descriptors.py`'s own
+normalization (power STFT with a Hamming window of 0.0232 s, scaled to unit
+peak for a full-scale sinusoid), though they are derived without it:
+
+    harmonic tone, resolved partials a_k at k * f0:
+        centroid = sum(k f0 a_k^2) / sum(a_k^2)
+        odd/even = sum(odd a_k^2) / sum(even a_k^2)
+        energy   = G * sum(a_k^2)
+    white noise of variance s^2, N = nfft / 2 + 1 exponential bins:
+        centroid = sr / 4
+        flatness = exp(-euler_gamma)       (E log X = log E X - gamma)
+        crest    = log(N) - log(log(2))    (median of the Gumbel maximum)
+        energy   = 2 * G * s^2
+        odd/even = 1
+
+with G = nfft * sum(w^2) / sum(w)^2 (Parseval).
+"""
+
+import json
+import numpy as np
+import os
+
+SR = 44100
+WIN_LENGTH = int(round(0.0232 * SR))
+NFFT = 2 ** int(np.ceil(np.log2(WIN_LENGTH)))
+
+window = np.hamming(WIN_LENGTH)
+GAIN = NFFT * np.sum(window ** 2) / np.sum(window) ** 2
+
+
+def tone_case(f0, amplitudes):
+    amplitudes = np.asarray(amplitudes)
+    harmonics = np.arange(1, len(amplitudes) + 1)
+    power = amplitudes ** 2
+    return {
+        'signal': {'type': 'tone', 'f0': f0,
+                   'amplitudes': amplitudes.tolist()},
+        'expected': {
+            'spectral_centroid': f0 * np.sum(harmonics * power)
+            / np.sum(power),
+            'odd_even_ratio': np.sum(power[0::2]) / np.sum(power[1::2]),
+            'energy': GAIN * np.sum(power),
+        },
+    }
+
+
+def noise_case(std, seed):
+    num_bins = NFFT // 2 + 1
+    return {
+        'signal': {'type': 'noise', 'std': std, 'seed': seed},
+        'expected': {
+            'spectral_centroid': SR / 4,
+            'spectral_flatness': np.exp(-np.euler_gamma),
+            'spectral_crest': np.log(num_bins) - np.log(np.log(2)),
+            'energy': 2 * GAIN * std ** 2,
+            'odd_even_ratio': 1.,
+        },
+    }
+
+
+if __name__ == '__main__':
+    reference = {
+        'description': 'Closed-form values of the descriptor definitions '
+                       'under descriptors.py normalization; a '
+                       'self-consistency check, not Timbre Toolbox output.',
+        'sample_rate': SR,
+        'duration': 1.,
+        # Relative tolerance on the median over frames, per descriptor.
+        'rtol': {
+            'energy': 0.02,
+            'spectral_centroid': 0.02,
+            'spectral_crest': 0.05,
+            'spectral_flatness': 0.02,
+            'odd_even_ratio': 0.05,
+        },
+        'cases': [
+            tone_case(220., [1., 0.5, 0.3, 0.25]),
+            tone_case(330., [1., 0.8, 0.6, 0.4, 0.2]),
+            noise_case(0.1, 0),
+        ],
+    }
+
+    path = os.path.join(os.path.dirname(__file__), 'timbre_reference.json')
+    with open(path, 'w') as handle:
+        json.dump(reference, handle, indent=2)
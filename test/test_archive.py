@@ -0,0 +1,105 @@
+"""
+Packed stimulus archive in `archive.py`: round trip, memory-mapped access
+and WAV export.
+"""
+
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import sys
+
+from scipy.io import wavfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from archive import ArchiveReader, ArchiveWriter, export_wavs, stimulus_key
+from data_util import parse_stimulus_paths
+from wav_writer import quantize
+
+
+def _build(path):
+    rng = np.random.RandomState(0)
+    signals = {}
+    with ArchiveWriter(path, 16000) as writer:
+        for subject in [200, 201]:
+            for block in [0, 1]:
+                for condition in ['BASIC', 'SIMPLE_RAF']:
+                    x = rng.uniform(-1, 1, 999)
+                    key = (subject, block, condition, 3)
+                    writer.add(*key, x, {'frame_rate': 100., 'energy': x[:5]})
+                    signals[key] = x
+            writer.add_log(subject, f"Subject: {subject}\n")
+
+        assert not os.path.exists(path)
+    return signals
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'stimuli.pack')
+    signals = _build(path)
+
+    reader = ArchiveReader(path)
+    assert list(reader) == list(signals)
+    assert reader.sample_rate == 16000
+    assert reader.logs[201] == "Subject: 201\n"
+
+    for key, x in signals.items():
+        pcm = reader.pcm(key)
+        assert isinstance(pcm, np.memmap)
+        np.testing.assert_array_equal(pcm, quantize(x))
+
+    stimulus = 'audio/subject_201/block_1/SIMPLE_RAF_3.wav'
+    assert stimulus_key(stimulus) == (201, 1, 'SIMPLE_RAF', 3)
+    assert stimulus in reader
+
+    descriptors = reader.descriptors(stimulus)
+    assert descriptors['frame_rate'] == 100.
+    np.testing.assert_array_equal(
+        descriptors['energy'], signals[201, 1, 'SIMPLE_RAF', 3][:5])
+
+
+def test_duplicates_and_truncation(tmp_path):
+    path = str(tmp_path / 'stimuli.pack')
+    with pytest.raises(ValueError):
+        with ArchiveWriter(path) as writer:
+            writer.add(200, 0, 'BASIC', 0, np.zeros(10))
+            writer.add(200, 0, 'BASIC', 0, np.zeros(10))
+    assert not os.path.exists(path)
+
+    _build(path)
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    with open(path, 'wb') as handle:
+        handle.write(data[:-10])
+    with pytest.raises(ValueError):
+        ArchiveReader(path)
+
+
+def test_export_wavs(tmp_path):
+    path = str(tmp_path / 'stimuli.pack')
+    signals = _build(path)
+
+    out_path = tmp_path / 'syn'
+    assert export_wavs(path, str(out_path), subjects=[201]) == 4
+    assert not (out_path / 'subject_200').exists()
+    assert (out_path / 'subject_201/stimlog_subject_201.txt').read_text() \
+        == "Subject: 201\n"
+
+    sr, pcm = wavfile.read(out_path / 'subject_201/block_0/BASIC_3.wav')
+    assert sr == 16000
+    np.testing.assert_array_equal(pcm, quantize(signals[201, 0, 'BASIC', 3]))
+    assert (out_path / 'subject_201/block_0/BASIC_3_descriptors.npz').exists()
+
+
+def test_stimulus_key_agrees_with_data_util():
+    paths = ['audio/subject_203/block_1/SIMPLE_RAF_2.wav',
+             'audio/subject_7/block_0/FM_ONLY_13.wav']
+    fields = parse_stimulus_paths(pd.Series(paths))
+
+    for path, (_, row) in zip(paths, fields.iterrows()):
+        assert stimulus_key(path) == (int(row['subjectNo']), int(row['block']),
+                                      row['condition'], int(row['repeat']))
+
+    with pytest.raises(KeyError):
+        stimulus_key('syn/subject_203/SIMPLE_RAF_2.wav')
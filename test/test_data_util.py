@@ -0,0 +1,143 @@
+"""
+Stimulus-path parsing, batch within-subject correlations, subject x
+condition summaries and cached CSV loading in `data_util.py`.
+"""
+
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from data_util import (anova_prep, extract_stimulus_fields, get_summary,
+                       read_cached, read_csvs, subject_condition_ratings,
+                       within_subject_correlations)
+
+
+@pytest.mark.parametrize('method', ['pearson', 'spearman'])
+def test_matches_pandas_groupby(method):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        'subjectNo': rng.choice(list('abcdef'), 300),
+        'response': rng.rand(300),
+    })
+    names = [f"f{k}" for k in range(10)]
+    for k, name in enumerate(names):
+        df[name] = rng.rand(300) + (k % 3 == 0) * df['response']
+
+    # Ties, and a feature constant within one subject.
+    df['f1'] = np.round(df['f1'] * 3)
+    df.loc[df['subjectNo'] == 'a', 'f2'] = 1.
+
+    expected = [
+        df.groupby('subjectNo')[name].corr(df['response'], method=method).mean()
+        for name in names
+    ]
+
+    by_name = within_subject_correlations(df, names, method, chunk_size=3)
+    by_array = within_subject_correlations(df, df[names].to_numpy(), method)
+
+    np.testing.assert_allclose(by_name.values, expected)
+    np.testing.assert_allclose(by_array, expected)
+
+
+def test_extract_stimulus_fields():
+    paths = [
+        'audio/subject_203/block_1/SIMPLE_RAF_2.wav',
+        'audio/subject_203/block_0/BASIC_0.wav',
+        'audio/subject_203/block_1/SIMPLE_RAF_2.wav',
+        'not/a/stimulus',
+    ]
+    for stimulus in [pd.Series(paths), pd.Series(paths, dtype='category')]:
+        df = extract_stimulus_fields(pd.DataFrame({'stimulus': stimulus}))
+
+        assert df['condition'].dtype == 'category'
+        assert list(df['subjectNo'][:3]) == ['203'] * 3
+        assert list(df['block'][:3]) == ['1', '0', '1']
+        assert list(df['condition'][:3]) == ['SIMPLE_RAF', 'BASIC', 'SIMPLE_RAF']
+        assert list(df['repeat'][:3]) == ['2', '0', '2']
+        assert df.iloc[3, 1:].isna().all()
+
+
+def test_subject_condition_summaries():
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        'subjectNo': rng.choice(['s0', 's1', 's2'], 200),
+        'condition': rng.choice(['BASIC', 'CONTROL', 'FM'], 200),
+        'response': rng.rand(200),
+    })
+    df = df[~((df['subjectNo'] == 's1') & (df['condition'] == 'FM'))]
+
+    summary = get_summary(df)
+    grouped = df.groupby('condition')['response']
+    np.testing.assert_allclose(summary['mean'], grouped.mean())
+    np.testing.assert_allclose(summary['std'], grouped.std())
+
+    long = anova_prep(df)
+    assert list(long['subjectNo']) == ['s0'] * 3 + ['s1'] * 3 + ['s2'] * 3
+    assert long['rating'].isna().sum() == 1
+    np.testing.assert_allclose(
+        long['rating'].dropna(),
+        df.groupby(['subjectNo', 'condition'])['response'].mean())
+
+    # A precomputed aggregate gives the same results.
+    ratings = subject_condition_ratings(df)
+    pd.testing.assert_frame_equal(get_summary(df, ratings), summary)
+    pd.testing.assert_frame_equal(anova_prep(df, ratings), long)
+
+
+def test_read_csvs(tmp_path):
+    files = []
+    for i in range(3):
+        files.append(str(tmp_path / f"{i}.csv"))
+        pd.DataFrame({'x': [i, i + 10]}).to_csv(files[-1], index=False)
+
+    df = read_csvs(files, num_workers=2, source_column='source')
+
+    assert list(df['x']) == [0, 10, 1, 11, 2, 12]
+    assert list(df['source']) == [0, 0, 1, 1, 2, 2]
+    assert list(df.index) == list(range(6))
+
+
+def test_read_cached_hits_and_invalidates(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('x,label\n1,a\n2,b\n')
+    cache_path = str(tmp_path / 'cache')
+    calls = []
+
+    def read():
+        calls.append(1)
+        return pd.read_csv(path)
+
+    first = read_cached([str(path)], read, cache_path)
+    second = read_cached([str(path)], read, cache_path)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second, check_dtype=False)
+
+    # Same size, new mtime.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    read_cached([str(path)], read, cache_path)
+    assert len(calls) == 2
+
+    # New size.
+    path.write_text('x,label\n1,a\n2,b\n3,c\n')
+    assert len(read_cached([str(path)], read, cache_path)) == 3
+    assert len(calls) == 3
+    read_cached([str(path)], read, cache_path)
+    assert len(calls) == 3
+
+
+def test_read_cached_falls_back_to_pickle(tmp_path):
+    # Mixed-type object columns can't be stored as Parquet.
+    df = pd.DataFrame({'mixed': [1, 'a', 2.5]})
+    path = tmp_path / 'data.csv'
+    path.write_text('x\n1\n')
+    cache_path = str(tmp_path / 'cache')
+
+    read_cached([str(path)], lambda: df, cache_path)
+    cached = read_cached([str(path)], lambda: None, cache_path)
+
+    assert list(cached['mixed']) == [1, 'a', 2.5]
@@ -0,0 +1,142 @@
+"""
+Native Timbre Toolbox descriptors in `descriptors.py`.
+"""
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import pytest
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from defaults import DATA_PATH
+from descriptors import estimate_f0, timbre_descriptors
+from synthesis import StimulusGenerator
+
+SR = 44100
+
+# Saved Timbre Toolbox output (see `feature_extraction.timbre_toolbox`).
+TT_PICKLE = os.path.join(DATA_PATH, 'TT_features.pickle')
+
+# Closed-form values of the descriptor definitions, under this module's own
+# normalization (see `fixtures/make_timbre_reference.py`). A self-consistency
+# check of the definitions, not parity with the Matlab toolbox.
+REFERENCE = os.path.join(os.path.dirname(__file__), 'fixtures',
+                         'timbre_reference.json')
+
+
+def harmonic_tone(f0, amplitudes, duration=0.5):
+    t = np.arange(int(duration * SR)) / SR
+    return sum(
+        a * np.sin(2 * np.pi * f0 * (k + 1) * t)
+        for k, a in enumerate(amplitudes)
+    )
+
+
+def test_sinusoid():
+    descriptors = timbre_descriptors(harmonic_tone(440, [1.]), SR)
+
+    np.testing.assert_allclose(descriptors['spectral_centroid'], 440, rtol=0.01)
+    assert np.all(descriptors['spectral_flatness'] < 1e-3)
+
+
+def test_odd_even_ratio():
+    amplitudes = [1., 0.5, 0.3, 0.25]
+    expected = (1 + 0.3**2) / (0.5**2 + 0.25**2)
+
+    ratio = timbre_descriptors(harmonic_tone(220, amplitudes), SR)['odd_even_ratio']
+
+    np.testing.assert_allclose(np.median(ratio), expected, rtol=0.1)
+
+
+def test_batch_matches_single():
+    batch = np.stack([
+        harmonic_tone(220, [1., 0.5]),
+        harmonic_tone(330, [1., 0., 1.]),
+    ])
+
+    np.testing.assert_allclose(estimate_f0(batch, SR), [220, 330], rtol=0.01)
+
+    batched = timbre_descriptors(batch, SR)
+    for i, x in enumerate(batch):
+        single = timbre_descriptors(x, SR)
+        for name, value in single.items():
+            np.testing.assert_allclose(batched[name][i], value)
+
+
+@pytest.mark.parametrize('synth_mode', ['default', 'pam'])
+def test_synthesis_descriptors_match_analysis(synth_mode):
+    np.random.seed(0)
+
+    # A smooth, moving spectral envelope (frames x bins).
+    t = np.linspace(0, 1, 40, endpoint=False)[:, None]
+    bins = np.arange(1025)[None, :]
+    env = np.exp(-bins / 80.) * (1 + 0.5 * np.cos(2 * np.pi * t + bins / 30.))
+
+    generator = StimulusGenerator(emit_descriptors=True)
+    x = generator(f0=130.8, fm_depth=0.13, env=env, num_partials=40,
+                  length=1., mod_rate=5., mod_hold=0., mod_fade=0.,
+                  synth_mode=synth_mode, audio_fade=0.1)
+
+    synthesized = generator.pop_descriptors()
+    analysed = timbre_descriptors(x, SR, f0=130.8)
+
+    assert not generator.descriptor_history
+    for name in ['spectral_centroid', 'odd_even_ratio']:
+        np.testing.assert_allclose(np.median(synthesized[name]),
+                                   np.median(analysed[name]), rtol=0.05)
+
+
+def test_definitions_self_consistency():
+    with open(REFERENCE) as handle:
+        reference = json.load(handle)
+    sr = reference['sample_rate']
+    num_samples = int(reference['duration'] * sr)
+
+    for case in reference['cases']:
+        spec = case['signal']
+        if spec['type'] == 'tone':
+            x = harmonic_tone(spec['f0'], spec['amplitudes'],
+                              reference['duration'])
+        else:
+            x = spec['std'] * np.random.RandomState(
+                spec['seed']).randn(num_samples)
+
+        descriptors = timbre_descriptors(x, sr)
+        for name, expected in case['expected'].items():
+            np.testing.assert_allclose(
+                np.median(descriptors[name]), expected,
+                rtol=reference['rtol'][name], err_msg=f"{spec}: {name}")
+
+
+@pytest.mark.skipif(not os.path.isfile(TT_PICKLE),
+                    reason="No saved Timbre Toolbox output.")
+def test_parity_with_timbre_toolbox():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from scipy.stats import spearmanr
+    from src.audio_io import read_wav
+    from src.feature_extraction import replace_path_to_local
+
+    # The saved output is a list of per-trial dicts.
+    with open(TT_PICKLE, 'rb') as handle:
+        df = pd.DataFrame(pickle.load(handle))
+    df = df.drop_duplicates('stimulus').head(50)
+
+    names = ['energy', 'spectral_centroid', 'spectral_crest',
+             'spectral_flatness', 'odd_even_ratio']
+    native = {name: [] for name in names}
+    reference = {name: [] for name in names}
+    for _, row in df.iterrows():
+        sr, x = read_wav(replace_path_to_local(row['stimulus']))
+        descriptors = timbre_descriptors(x, sr)
+        for name in names:
+            native[name].append(np.median(descriptors[name]))
+            reference[name].append(np.median(np.asarray(row[name])))
+
+    # Frame conventions differ slightly; stimuli should rank the same.
+    for name in names:
+        assert spearmanr(native[name], reference[name]).correlation > 0.9, \
+            name
@@ -0,0 +1,48 @@
+"""
+Held-out scoring of learnt kernels in `ext.evaluation`.
+"""
+
+import numpy as np
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ext.evaluation import held_out_correlations, kfold_indices, weighted_distances
+
+
+def test_matches_per_stimulus_loop():
+    rng = np.random.RandomState(0)
+    train_input = rng.rand(50, 12)
+    test_input = rng.rand(50, 3)
+    test_target = rng.rand(3, 12)
+    sigmas = np.abs(10 + rng.randn(50))
+
+    distances = weighted_distances(test_input, train_input, sigmas)
+    correlations = held_out_correlations(test_input, test_target, train_input, sigmas)
+
+    for m in range(3):
+        expected = np.array([
+            -np.sum(((test_input[:, m] - train_input[:, i]) / sigmas) ** 2)
+            for i in range(12)
+        ])
+        np.testing.assert_allclose(distances[m], expected, rtol=1e-10)
+
+        # As `training.py` logged it before scoring was vectorized.
+        Jn = np.sum((expected - np.mean(expected))
+                    * (test_target[m] - np.mean(test_target[m])))
+        Jd = np.std(test_target[m]) * np.std(expected) * (12 - 1)
+        np.testing.assert_allclose(correlations[m], Jn / Jd)
+
+    pearson = held_out_correlations(test_input, test_target, train_input,
+                                    sigmas, ddof=0)
+    for m in range(3):
+        np.testing.assert_allclose(
+            pearson[m], np.corrcoef(distances[m], test_target[m])[0, 1])
+
+
+def test_kfold_indices_partition():
+    folds = kfold_indices(23, 5, seed=0)
+
+    assert len(folds) == 5
+    np.testing.assert_array_equal(np.sort(np.concatenate(folds)), np.arange(23))
@@ -0,0 +1,68 @@
+"""
+Content-addressed, resumable storage in `feature_store.py`.
+"""
+
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from feature_store import FeatureStore
+
+
+def test_round_trip_and_subset(tmp_path):
+    store = FeatureStore(str(tmp_path), 'strf', version=1, params={'a': 1})
+    arrays = {'strf': np.random.rand(4, 3, 2), 'energy': np.arange(5.)}
+
+    store.put('abc123', arrays)
+    store.link('stim.wav', 'abc123')
+
+    assert 'abc123' in store
+    loaded = store.get('abc123', names=['energy'])
+    assert list(loaded) == ['energy']
+    np.testing.assert_array_equal(loaded['energy'], arrays['energy'])
+
+    # A new instance recovers the index, and skips rewriting stored items.
+    reopened = FeatureStore(str(tmp_path), 'strf', version=1, params={'a': 1})
+    assert reopened.key_of('stim.wav') == 'abc123'
+    reopened.put('abc123', {'strf': np.zeros(1)})
+    np.testing.assert_array_equal(reopened.get('abc123')['strf'], arrays['strf'])
+
+    frame = reopened.to_frame(['stim.wav', 'stim.wav'])
+    assert len(frame) == 1
+
+
+def test_namespaces_by_version_and_params(tmp_path):
+    store = FeatureStore(str(tmp_path), 'strf', version=1, params={'a': 1})
+    store.put('abc123', {'strf': np.zeros(1)})
+
+    assert 'abc123' not in FeatureStore(str(tmp_path), 'strf', version=2,
+                                        params={'a': 1})
+    assert 'abc123' not in FeatureStore(str(tmp_path), 'strf', version=1,
+                                        params={'a': 2})
+
+
+def test_content_hash(tmp_path):
+    a, b = tmp_path / 'a.bin', tmp_path / 'b.bin'
+    a.write_bytes(b'same')
+    b.write_bytes(b'same')
+    assert FeatureStore.content_hash(str(a)) == FeatureStore.content_hash(str(b))
+
+
+def test_to_frame_skips_missing_stimuli(tmp_path):
+    store = FeatureStore(str(tmp_path), 'strf', version=1, params={})
+    store.put('abc123', {'energy': np.float64(2.)})
+    store.link('done.wav', 'abc123')
+
+    frame = store.to_frame(['done.wav', 'todo.wav', 'done.wav'])
+    assert list(frame['stimulus']) == ['done.wav']
+
+    trials = pd.DataFrame({'stimulus': ['done.wav', 'todo.wav']})
+    joined = pd.merge(trials, frame, on='stimulus', how='left')
+    assert joined['energy'].tolist()[0] == 2.
+    assert np.isnan(joined['energy'].tolist()[1])
+
+    empty = store.to_frame(['todo.wav'])
+    assert len(pd.merge(trials, empty, on='stimulus', how='left')) == 2
@@ -0,0 +1,64 @@
+"""
+Cached SOS lowpass and streaming onset detection in `filters.py`.
+"""
+
+import numpy as np
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from scipy.signal import butter, filtfilt, hilbert
+
+from defaults import EPS
+from filters import butter_sos, find_onset, low_pass
+from util import get_amp_envelope, trim_silence
+
+
+def test_design_is_cached():
+    assert butter_sos(16, 10., 200) is butter_sos(16, 10., 200)
+
+
+def test_low_pass_matches_ba_form():
+    x = np.random.default_rng(0).standard_normal(2000)
+    b, a = butter(4, 10. / 100, btype='lowpass')
+    expected = filtfilt(b, a, x)
+    np.testing.assert_allclose(low_pass(x, 10., 200, order=4), expected,
+                               atol=1e-10)
+
+
+def test_trim_silence_default_matches_hilbert_on_step():
+    # As `analysis.py` trims the single-cycle recordings (threshold -5).
+    sr = 44100
+    t = np.arange(sr) / sr
+    x = 0.01 * np.sin(2 * np.pi * 220 * t) * (t >= 0.3)
+
+    b, a = butter(4, 25. / (sr / 2), btype='lowpass')
+    envelope = filtfilt(b, a, np.abs(hilbert(x)))
+    expected = np.flatnonzero(np.log(envelope + EPS) >= -5)[0]
+    assert abs(expected - 0.3 * sr) < 0.01 * sr
+
+    # The SOS form pads the edges differently, so the envelopes are close,
+    # not identical; the onset index still is.
+    np.testing.assert_allclose(get_amp_envelope(x, 25., sr), envelope,
+                               rtol=0, atol=1e-5 * envelope.max())
+
+    trimmed = trim_silence(x, -5, sr=sr)
+    assert len(x) - len(trimmed) == expected
+
+
+def test_onset_matches_hilbert_envelope():
+    sr = 44100
+    t = np.arange(2 * sr) / sr
+    x = 0.8 * np.sin(2 * np.pi * 220 * t) * np.clip((t - 0.3) / 0.2, 0, 1)
+
+    for threshold in [-1., -0.5]:
+        expected = len(x) - len(
+            trim_silence(x, threshold, sr=sr, streaming=False)
+        )
+        actual = find_onset(x, threshold, sr=sr)
+        assert abs(actual - expected) <= 0.001 * sr
+
+
+def test_onset_not_found():
+    assert find_onset(np.zeros(10000), -1.) is None
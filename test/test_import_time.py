@@ -0,0 +1,45 @@
+"""
+Import-time budget for the core synthesis path.
+
+Synthesis workers are spawned in process pools, so `synthesis` (and `util`
+underneath it) must not pull in matplotlib, librosa, Matlab or SciPy.
+"""
+
+import os
+import subprocess
+import sys
+
+SRC_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__), '../src'))
+
+# Seconds, measured on top of a bare interpreter with numpy already imported.
+IMPORT_TIME_BUDGET = 0.5
+
+HEAVY_MODULES = ['librosa', 'matlab', 'matplotlib', 'scipy']
+
+_PROBE = f"""
+import sys, time
+import numpy
+start = time.perf_counter()
+import synthesis
+print(time.perf_counter() - start)
+print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+def _probe():
+    env = dict(os.environ, PYTHONPATH=SRC_PATH)
+    out_ = subprocess.run(
+        [sys.executable, '-c', _PROBE],
+        capture_output=True, text=True, check=True, env=env, cwd=SRC_PATH
+    ).stdout.split('\n')
+    return float(out_[0]), out_[1]
+
+
+def test_synthesis_skips_heavy_imports():
+    _, loaded = _probe()
+    assert loaded == '', f"Synthesis path imported: {loaded}"
+
+
+def test_synthesis_import_budget():
+    elapsed, _ = _probe()
+    assert elapsed < IMPORT_TIME_BUDGET, f"Import took {elapsed:.3f}s."
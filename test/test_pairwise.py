@@ -0,0 +1,108 @@
+"""
+Pairwise-distance engine behind `ext.training.kernel_optim_lbfgs_log`.
+"""
+
+import numpy as np
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ext.pairwise import PairwiseDifferences, full_kernel, sample_pairs
+
+EPS = np.finfo(float).eps
+
+
+def loop_reference(input_data, target_values, sigmas):
+    """
+    Correlation and gradient as the original double loop computed them.
+    """
+    num_features, num_stimuli = input_data.shape
+    idx_triu = np.triu_indices(num_stimuli, k=1)
+
+    kernel = np.zeros((num_stimuli, num_stimuli))
+    dkernel = np.zeros((num_stimuli, num_stimuli, num_features))
+    for i in range(num_stimuli):
+        for j in range(i + 1, num_stimuli):
+            diff = input_data[:, i] - input_data[:, j]
+            kernel[i, j] = -np.sum((diff / (sigmas + EPS)) ** 2)
+            dkernel[i, j] = 2 * diff ** 2 / (sigmas ** 3 + EPS)
+
+    kernel_v = kernel[idx_triu]
+    mean_kernel, std_kernel = np.mean(kernel_v), np.std(kernel_v)
+    mean_target, std_target = np.mean(target_values), np.std(target_values)
+
+    Jn = np.sum((kernel_v - mean_kernel) * (target_values - mean_target))
+    Jd = len(kernel_v) * std_target * std_kernel
+
+    gradients = np.zeros(num_features)
+    for k in range(num_features):
+        tmp = dkernel[:, :, k][idx_triu]
+        dJn = np.sum(tmp * (target_values - mean_target))
+        dJd = std_target / (std_kernel + EPS) * np.sum(tmp * (kernel_v - mean_kernel))
+        gradients[k] = (Jd * dJn - Jn * dJd) / (Jd ** 2 + EPS)
+
+    return Jn / Jd, gradients
+
+
+def test_matches_loops(tmp_path):
+    rng = np.random.RandomState(0)
+    input_data = rng.rand(40, 10)
+    target_values = rng.rand(45)
+    sigmas = np.abs(10 + 0.5 * rng.randn(40))
+
+    expected_corr, expected_grad = loop_reference(input_data, target_values, sigmas)
+
+    for kwargs, rtol in [
+        ({}, 1e-12),
+        ({'memmap_path': str(tmp_path / 'pairs.npy'), 'chunk_size': 7}, 1e-12),
+        ({'dtype': np.float32, 'chunk_size': 7}, 1e-5),
+    ]:
+        pairwise = PairwiseDifferences(input_data, **kwargs)
+        corr, grad = pairwise.correlation_and_gradient(sigmas, target_values)
+
+        np.testing.assert_allclose(corr, expected_corr, rtol=rtol)
+        np.testing.assert_allclose(grad, expected_grad, rtol=rtol,
+                                   atol=rtol * np.abs(expected_grad).max())
+
+    # Filled in place, e.g. into a shared-memory buffer.
+    out_ = np.empty((45, 40), dtype=np.float32)
+    assert PairwiseDifferences(input_data, out=out_).squared is out_
+    np.testing.assert_allclose(
+        out_, PairwiseDifferences(input_data).squared, rtol=1e-6)
+
+
+def test_dropout_gradient_lands_on_kept_features():
+    rng = np.random.RandomState(1)
+    input_data = rng.rand(20, 8)
+    target_values = rng.rand(28)
+    sigmas = np.abs(10 + 0.5 * rng.randn(20))
+
+    kept = np.sort(rng.permutation(20)[:12])
+    mask = np.zeros(20)
+    mask[kept] = 1.
+
+    pairwise = PairwiseDifferences(input_data)
+    corr, grad = pairwise.correlation_and_gradient(sigmas, target_values, mask)
+
+    expected_corr, expected_grad = loop_reference(
+        input_data[kept], target_values, sigmas[kept])
+
+    np.testing.assert_allclose(corr, expected_corr)
+    np.testing.assert_allclose(grad[kept], expected_grad)
+    assert np.all(grad[mask == 0] == 0)
+
+
+def test_full_kernel_and_pair_sampling():
+    rng = np.random.RandomState(2)
+    input_data = rng.rand(30, 25)
+    sigmas = np.abs(10 + rng.randn(30))
+
+    np.testing.assert_allclose(
+        full_kernel(input_data, sigmas, block_size=4),
+        PairwiseDifferences(input_data).kernel(sigmas),
+        rtol=1e-10)
+
+    rows, cols = sample_pairs(rng, 25, 1000)
+    assert np.all(rows < cols)
+    assert cols.max() < 25
@@ -2,7 +2,7 @@
 Very quick and dirty test to see if the STRF model is working properly.
 """
 
-from src.util import read_wav
+from src.audio_io import read_wav
 from ext.auditory import strf
 
 demo_path = '/Users/maxsolomonhenry/Documents/Python/amp_mod/audio/syn/subject_3/block_0/BASIC_2.wav'
@@ -0,0 +1,135 @@
+"""
+Stochastic mode (checkpointing and resume), parallel multi-start and
+parallel cross-validation in `ext/training.py`.
+"""
+
+import numpy as np
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ext.evaluation import held_out_correlations, symmetric_targets
+from ext.training import (kernel_optim_kfold, kernel_optim_lbfgs_log,
+                          kernel_optim_multistart, kernel_optim_stochastic)
+
+
+def test_stochastic_resume_continues_the_same_run(tmp_path):
+    rng = np.random.RandomState(0)
+    input_data = rng.rand(8, 40)
+    target_data = rng.rand(40, 40)
+    target_data += target_data.T
+
+    kwargs = {'batch_pairs': 64, 'eval_every': 50, 'verbose': False,
+              'seed': 3}
+
+    os.makedirs(tmp_path / 'full')
+    expected = kernel_optim_stochastic(
+        input_data, target_data, num_steps=200,
+        log_foldername=str(tmp_path / 'full'), **kwargs)
+
+    # Interrupted after 100 steps, then resumed from its checkpoint.
+    os.makedirs(tmp_path / 'resumed')
+    log_foldername = str(tmp_path / 'resumed')
+    kernel_optim_stochastic(input_data, target_data, num_steps=100,
+                            log_foldername=log_foldername, **kwargs)
+    with open(os.path.join(log_foldername, 'checkpoint.pkl'), 'rb') as handle:
+        resume = pickle.load(handle)
+    assert resume['optimizer_state']['step'] == 100
+
+    correlations, sigmas = kernel_optim_stochastic(
+        input_data, target_data, num_steps=200,
+        log_foldername=log_foldername, resume=resume, **kwargs)
+
+    np.testing.assert_allclose(correlations, expected[0])
+    np.testing.assert_allclose(sigmas, expected[1])
+
+
+def test_kfold_matches_serial_folds(tmp_path):
+    rng = np.random.RandomState(0)
+    input_data = rng.rand(6, 15)
+    target_data = rng.rand(15, 15)
+    targets = symmetric_targets(target_data)
+
+    kwargs = {'num_loops': 5, 'seed': 1}
+    results = kernel_optim_kfold(input_data, target_data, num_folds=3,
+                                 num_workers=2, log_foldername=str(tmp_path),
+                                 **kwargs)
+
+    assert [result['fold'] for result in results] == [0, 1, 2]
+    np.testing.assert_array_equal(
+        np.sort(np.concatenate([r['test_idx'] for r in results])),
+        np.arange(15))
+
+    for result in results:
+        test_idx = result['test_idx']
+        train_idx = np.setdiff1d(np.arange(15), test_idx)
+
+        os.makedirs(tmp_path / 'serial', exist_ok=True)
+        correlations, sigmas = kernel_optim_lbfgs_log(
+            input_data[:, train_idx], targets[np.ix_(train_idx, train_idx)],
+            log_foldername=str(tmp_path / 'serial'), verbose=False, **kwargs)
+        np.testing.assert_allclose(result['sigmas'], sigmas)
+        np.testing.assert_allclose(result['correlations'], correlations)
+
+        expected = held_out_correlations(
+            input_data[:, test_idx], targets[np.ix_(test_idx, train_idx)],
+            input_data[:, train_idx], sigmas)
+        np.testing.assert_allclose(result['test_correlations'], expected)
+        assert result['test_correlation'] == np.mean(
+            result['test_correlations'])
+
+
+def test_multistart_sorts_restarts_and_matches_serial(tmp_path):
+    rng = np.random.RandomState(0)
+    input_data = rng.rand(6, 12)
+    target_data = rng.rand(12, 12)
+    target_data += target_data.T
+
+    results = kernel_optim_multistart(
+        input_data, target_data, seeds=[0, 1, 2], num_workers=2,
+        log_foldername=str(tmp_path), num_loops=5)
+
+    assert sorted(result['seed'] for result in results) == [0, 1, 2]
+    objectives = [result['objective'] for result in results]
+    assert objectives == sorted(objectives)
+
+    for result in results:
+        os.makedirs(tmp_path / 'serial', exist_ok=True)
+        _, _, res = kernel_optim_lbfgs_log(
+            input_data, target_data, num_loops=5, seed=result['seed'],
+            log_foldername=str(tmp_path / 'serial'), verbose=False,
+            return_result=True)
+        np.testing.assert_allclose(result['objective'], res.fun)
+        np.testing.assert_allclose(result['x'], res.x)
+
+    # Workers mapping the squared differences from a file agree.
+    mapped = kernel_optim_multistart(
+        input_data, target_data, seeds=[0, 1, 2], num_workers=2,
+        log_foldername=str(tmp_path / 'mapped'), num_loops=5,
+        pairwise_memmap=str(tmp_path / 'squared.npy'))
+    for result, expected in zip(mapped, results):
+        assert result['seed'] == expected['seed']
+        np.testing.assert_allclose(result['x'], expected['x'])
+
+
+def test_multistart_seeds_dual_annealing(tmp_path):
+    rng = np.random.RandomState(0)
+    input_data = rng.rand(3, 8)
+    target_data = rng.rand(8, 8)
+    target_data += target_data.T
+
+    results = kernel_optim_multistart(
+        input_data, target_data, seeds=[4, 5], num_workers=2,
+        log_foldername=str(tmp_path / 'a'), num_loops=3,
+        method='dual_annealing')
+    again = kernel_optim_multistart(
+        input_data, target_data, seeds=[4, 5], num_workers=2,
+        log_foldername=str(tmp_path / 'b'), num_loops=3,
+        method='dual_annealing')
+
+    by_seed = {result['seed']: result for result in again}
+    for result in results:
+        np.testing.assert_allclose(result['x'], by_seed[result['seed']]['x'])
+        assert result['objective'] == by_seed[result['seed']]['objective']
@@ -0,0 +1,57 @@
+"""
+Quantization and the background WAV writer in `wav_writer.py`.
+"""
+
+import numpy as np
+import os
+import sys
+
+from scipy.io import wavfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from wav_writer import WavWriter, quantize
+
+
+def test_quantize_does_not_modify_input():
+    x = np.array([0., 0.5, -0.5, 1., -1., 1.5])
+    original = x.copy()
+
+    pcm = quantize(x)
+
+    np.testing.assert_array_equal(x, original)
+    np.testing.assert_array_equal(
+        pcm, [0, 16384, -16384, 32767, -32767, 32767])
+
+
+def test_dither_stays_within_one_lsb():
+    x = np.linspace(-0.9, 0.9, 10000)
+    rng = np.random.default_rng(0)
+
+    error = quantize(x, dither=True, rng=rng) - x * np.iinfo(np.int16).max
+
+    assert np.abs(error).max() <= 1.5
+    assert abs(error.mean()) < 0.05
+
+
+def test_writer_round_trip(tmp_path):
+    rng = np.random.RandomState(0)
+    signals = [rng.uniform(-1, 1, 1000) for _ in range(10)]
+
+    with WavWriter(16000, num_threads=3, max_queue=2) as writer:
+        for k, x in enumerate(signals):
+            extras = {'energy': x[:4]} if k == 0 else None
+            writer.submit(str(tmp_path / f"x_{k}.wav"), x, extras=extras)
+
+    stats = writer.stats()
+    assert stats['submitted'] == stats['written'] == len(signals)
+    assert stats['max_queue_depth'] <= 2
+
+    for k, x in enumerate(signals):
+        sr, pcm = wavfile.read(tmp_path / f"x_{k}.wav")
+        assert sr == 16000
+        np.testing.assert_array_equal(pcm, quantize(x))
+
+    saved = np.load(tmp_path / 'x_0_descriptors.npz')
+    np.testing.assert_array_equal(saved['energy'], signals[0][:4])
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path))